@@ -5,118 +5,229 @@ Creaated on 2023-02-21
 """
 
 # Import the necessary libraries
+import sys
+from time import monotonic
+import numpy as np
 import PySimpleGUI as sg
-from linact import Carrier
-# import threading
-# import time
-# import asyncio
-
-
-# Create a carrier object
-carrier = Carrier()
-# initialize the carrier
-carrier.initialize()
-
-# Use the theme for the GUI
-sg.theme('DarkAmber')
-
-# Create a frame for current position
-frame_layout0 = [   [sg.Text('Move x-axis'), sg.InputText(key = "-Move_X-" ,size=(10, 1)), sg.Button('Move-x')], 
-                    [sg.Text('Move y-axis'), sg.InputText(key = "-Move_Y-" ,size=(10, 1)), sg.Button('Move-y')],
-                    [sg.Text('Move z-axis'), sg.InputText(key = "-Move_Z-" ,size=(10, 1)), sg.Button('Move-z')],
-                    [sg.Checkbox('Non safe mode', default = False, key = "-Non_safe_mode-")]
-                ]
-
-frame_layout1 = [   [sg.Text('x-axis'), sg.InputText(key = "-Current_position_x-" ,size=(10, 1))],
-                    [sg.Text('y-axis'), sg.InputText(key = "-Current_position_y-" ,size=(10, 1))],
-                    [sg.Text('z-axis'), sg.InputText(key = "-Current_position_z-" ,size=(10, 1))]
-                ]
-
-frame_layout2 = [   [sg.Text('Current x velocity'), sg.InputText(key = "-Current_x_end_velocity-" ,size=(10, 1)), 
-                     sg.Text('New x velocity'), sg.InputText(key = "-New_x_end_velocity-" ,size=(10, 1)), sg.Button('Update x Velocity')],
-                    [sg.Text('Current y velocity'), sg.InputText(key = "-Current_y_end_velocity-" ,size=(10, 1)), 
-                     sg.Text('New y velocity'), sg.InputText(key = "-New_y_end_velocity-" ,size=(10, 1)), sg.Button('Update y Velocity')],
-                    [sg.Text('Current z velocity'), sg.InputText(key = "-Current_z_end_velocity-" ,size=(10, 1)), 
-                     sg.Text('New z velocity'), sg.InputText(key = "-New_z_end_velocity-" ,size=(10, 1)), sg.Button('Update z Velocity')]
-                ]
-
-
-# Create the layout for the GUI
-layout = [  [sg.Text('Mapper GUI')],
-            [sg.Frame('Move axis', frame_layout0)], 
-            [sg.Frame('Current position', frame_layout1)],
-            [sg.Frame('Axis velocity', frame_layout2)],
-            [sg.Button('Initialize'), sg.Button('Shutdown')]]
-
-# Create the window
-window = sg.Window('Mapper GUI', layout)
-
-
-# Function to update the current position
-def update_position():
-    # Display the current position
-    window['-Current_position_x-'].update(carrier.get_position(float(0)))
-    window['-Current_position_y-'].update(carrier.get_position(float(1)))
-    window['-Current_position_z-'].update(carrier.get_position(float(2)))
-
-
-# Function to get all axis end velocity
-def update_axis_end_velocity():
-    # Display the current velocity
-    window['-Current_x_end_velocity-'].update(carrier.get_end_velocity(0))
-    window['-Current_y_end_velocity-'].update(carrier.get_end_velocity(1))
-    window['-Current_z_end_velocity-'].update(carrier.get_end_velocity(2))
-
-while True:
-    event, values = window.read(timeout=0)
-    
-    update_position()
-    update_axis_end_velocity()    
-    
-    move_x = values["-Move_X-"]
-    move_y = values["-Move_Y-"]
-    move_z = values["-Move_Z-"]
-    non_safe_mode = values["-Non_safe_mode-"]
-
-    if event == sg.WIN_CLOSED or event == 'Shutdown': # if user closes window or clicks shutdown
-        # shutdown the carrier
-        carrier.shutdown()
-        window.close()
-      
-    # Move the x-axis
-    if event == 'Move-x' and non_safe_mode == True:
-        # call the move_to function from linact.py and read the input from the GUI
-        carrier._move(float(move_x), 0)
-    # Move the x-axis without checking the limit
-    elif event == 'Move-x':
-        # call the _move function from linact.py and read the input from the GUI
-        carrier.move_to(float(move_x), 0)
-
-    # Move the y-axis
-    if event == 'Move-y' and non_safe_mode == True:
-        # call the move_to function from linact.py and read the input from the GUI
-        carrier._move(float(move_y), 1)
-    # Move the y-axis without checking the limit
-    elif event == 'Move-y':
-        # call the _move function from linact.py and read the input from the GUI
-        carrier.move_to(float(move_y), 1)
-
-    # Move the z-axis
-    if event == 'Move-z' and non_safe_mode == True:
-        # call the move_to function from linact.py and read the input from the GUI
-        carrier._move(float(move_z), 2)
-    # Move the z-axis without checking the limit
-    elif event == 'Move-z':
-        # call the _move function from linact.py and read the input from the GUI
-        carrier.move_to(float(move_z), 2)
-    
+from linact import Carrier, AXES, VELOCITY_PROFILE
+from history import PositionHistory
+from worker import CarrierWorker
+from server import DEFAULT_ADDRESS, GantryClient
+
+# Seconds between two position polls of the worker
+STATUS_INTERVAL = 0.5
+# Milliseconds the event loop waits for user input per frame
+FRAME_TIMEOUT = 50
+# Motion journal that lets a restarted GUI keep the coordinate frame
+JOURNAL = 'motion_journal.jsonl'
+# Seconds between two redraws of the trajectory plots, whatever the
+# poll rate is
+PLOT_INTERVAL = 0.1
+# Polled positions kept, and drawn at most per plot and frame
+HISTORY_SIZE = 20000
+PLOT_POINTS = 500
+PLOT_SIZE = (300, 300)
+# Plot key: (horizontal, vertical) axis
+PLOTS = {'-Plot_XY-': (0, 1), '-Plot_XZ-': (0, 2)}
+# (min, max) cm per axis, used until the carrier's limits are known
+DEFAULT_LIMITS = ((0.0, 80.0), (-30.0, 30.0), (0.0, 80.0))
+
+
+def make_plot(key, limits):
+    horizontal, vertical = PLOTS[key]
+    return sg.Graph(canvas_size=PLOT_SIZE,
+                    graph_bottom_left=(limits[horizontal][0],
+                                       limits[vertical][0]),
+                    graph_top_right=(limits[horizontal][1],
+                                     limits[vertical][1]),
+                    background_color='black', key=key)
+
+
+def make_window(limits=DEFAULT_LIMITS, scan: bool = False):
+    # Use the theme for the GUI
+    sg.theme('DarkAmber')
+
+    # Create a frame for current position
+    frame_layout0 = [   [sg.Text('Move x-axis'), sg.InputText(key = "-Move_X-" ,size=(10, 1)), sg.Button('Move-x')], 
+                        [sg.Text('Move y-axis'), sg.InputText(key = "-Move_Y-" ,size=(10, 1)), sg.Button('Move-y')],
+                        [sg.Text('Move z-axis'), sg.InputText(key = "-Move_Z-" ,size=(10, 1)), sg.Button('Move-z')],
+                        [sg.Checkbox('Non safe mode', default = False, key = "-Non_safe_mode-")]
+                    ]
+
+    frame_layout1 = [   [sg.Text('x-axis'), sg.InputText(key = "-Current_position_x-" ,size=(10, 1))],
+                        [sg.Text('y-axis'), sg.InputText(key = "-Current_position_y-" ,size=(10, 1))],
+                        [sg.Text('z-axis'), sg.InputText(key = "-Current_position_z-" ,size=(10, 1))]
+                    ]
+
+    frame_layout2 = [   [sg.Text('Current x velocity'), sg.InputText(key = "-Current_x_end_velocity-" ,size=(10, 1)), 
+                         sg.Text('New x velocity'), sg.InputText(key = "-New_x_end_velocity-" ,size=(10, 1)), sg.Button('Update x Velocity')],
+                        [sg.Text('Current y velocity'), sg.InputText(key = "-Current_y_end_velocity-" ,size=(10, 1)), 
+                         sg.Text('New y velocity'), sg.InputText(key = "-New_y_end_velocity-" ,size=(10, 1)), sg.Button('Update y Velocity')],
+                        [sg.Text('Current z velocity'), sg.InputText(key = "-Current_z_end_velocity-" ,size=(10, 1)), 
+                         sg.Text('New z velocity'), sg.InputText(key = "-New_z_end_velocity-" ,size=(10, 1)), sg.Button('Update z Velocity')]
+                    ]
+
+
+    # Trajectory seen from above (XY) and from the side (XZ)
+    frame_layout3 = [   [sg.Text('XY'), make_plot('-Plot_XY-', limits),
+                         sg.Text('XZ'), make_plot('-Plot_XZ-', limits)]
+                    ]
+
+    # Create the layout for the GUI
+    layout = [  [sg.Text('Mapper GUI')],
+                [sg.Frame('Move axis', frame_layout0)], 
+                [sg.Frame('Current position', frame_layout1)],
+                [sg.Frame('Axis velocity', frame_layout2)],
+                [sg.Frame('Trajectory', frame_layout3)],
+                [sg.Button('Initialize'), sg.Button('Stop'), sg.Button('Shutdown')] +
+                ([sg.Button('Scan')] if scan else [])]
+
+    # Create the window
+    return sg.Window('Mapper GUI', layout)
+
+
+# Function to update the current position and axis end velocity
+def update_status(window, status, shown, history=None):
+    # Keep every new poll for the trajectory plots
+    if history is not None and status['time'] is not None and \
+            shown.get('time') != status['time']:
+        history.append(status['time'], status['position'])
+        shown['time'] = status['time']
+    # Only touch the elements whose value changed since the last frame
+    for axis, name in enumerate(AXES):
+        position = status['position'][axis]
+        key = '-Current_position_{0}-'.format(name.lower())
+        if position is not None and shown.get(key) != position:
+            window[key].update(position)
+            shown[key] = position
+        velocity = status['end_velocity'][axis]
+        key = '-Current_{0}_end_velocity-'.format(name.lower())
+        if velocity is not None and shown.get(key) != velocity:
+            window[key].update(velocity)
+            shown[key] = velocity
+
+
+# Every n-th row of an array so that at most count remain
+def thin(rows, count):
+    return rows[::-(-len(rows) // count)] if len(rows) > count else rows
+
+
+# Function to redraw the trajectory plots and the scan overlay
+def update_plot(window, history, scan=None, drawn=None):
+    # Nothing to do unless a new position came in or a point was visited
+    version = (history.version,
+               None if scan is None else int(np.count_nonzero(scan.visited)))
+    if drawn is not None:
+        if drawn.get('version') == version:
+            return False
+        drawn['version'] = version
+    trajectory = history.decimated(PLOT_POINTS)
+    trajectory = trajectory[~np.isnan(trajectory[:, 1:]).any(axis=1)]
+    if scan is not None:
+        visited = thin(scan.points[scan.visited], PLOT_POINTS)
+        pending = thin(scan.points[~scan.visited], PLOT_POINTS)
+    for key, (horizontal, vertical) in PLOTS.items():
+        graph = window[key]
+        graph.erase()
+        if scan is not None:
+            # Scan points: pending grey, visited green
+            for points, color in ((pending, 'gray'), (visited, 'green')):
+                for point in points:
+                    graph.draw_point((point[horizontal], point[vertical]),
+                                     size=0.3, color=color)
+        path = [(row[horizontal + 1], row[vertical + 1]) for row in trajectory]
+        if len(path) > 1:
+            graph.draw_lines(path, color='yellow')
+        if path:
+            graph.draw_point(path[-1], size=1.0, color='red')
+    return True
+
+
+# Function to queue the carrier command belonging to a button
+def handle_event(worker, event, values, scan=None, measure=None):
+    carrier = worker.carrier
+    for axis, name in enumerate(AXES):
+        if event == 'Move-' + name.lower():
+            try:
+                position = float(values['-Move_{0}-'.format(name)])
+            except ValueError:
+                return None
+            # Move without checking the limit
+            if values["-Non_safe_mode-"]:
+                return worker.submit(carrier._move, position, axis)
+            return worker.submit(carrier.move_to, position, axis)
+        # Update the end velocity
+        if event == 'Update {0} Velocity'.format(name.lower()):
+            velocity = values['-New_{0}_end_velocity-'.format(name.lower())]
+            return worker.submit(carrier._set_end_velocity, axis, velocity)
     if event == 'Initialize':
         # initialize the carrier
-        carrier.initialize()
-
-    # Below is the code that update the end velocity
-    carrier._set_end_velocity(0, values["-New_x_end_velocity-"])
-    carrier._set_end_velocity(1, values["-New_y_end_velocity-"])
-    carrier._set_end_velocity(2, values["-New_z_end_velocity-"])
-    
-window.close()
\ No newline at end of file
+        return worker.submit(carrier.initialize)
+    if event == 'Stop':
+        # Stop at once, skipping and cancelling the queued commands
+        return worker.halt()
+    if event == 'Scan' and scan is not None:
+        # Runs on the worker, Stop ends it. The poll waits meanwhile, so
+        # every point reached is published instead
+        return worker.submit(scan.run, measure, worker.publish_position)
+    return None
+
+
+def main(status_interval: float = STATUS_INTERVAL, address=None,
+         carrier=None, scan=None, measure=None):
+    # carrier: an existing Carrier to use instead of opening one
+    # scan: a scan.Scan of that carrier, run by the Scan button and shown
+    # on the plots; measure is passed to Scan.run
+    if scan is not None:
+        if address is not None:
+            raise ValueError("Scans run in the process owning the carrier")
+        if carrier is not None and scan.carrier is not carrier:
+            raise ValueError("The scan belongs to another carrier")
+        carrier = scan.carrier
+    if address is not None:
+        # Use the carrier of a running gantry server (server.py)
+        worker = GantryClient(address)
+        carrier = worker.carrier
+    else:
+        # Create a carrier object unless given one and hand its serial
+        # port to the worker
+        if carrier is None:
+            carrier = Carrier(profile=VELOCITY_PROFILE, journal=JOURNAL)
+        worker = CarrierWorker(carrier, status_interval)
+        worker.start()
+        # initialize the carrier
+        worker.submit(carrier.initialize)
+
+    window = make_window(worker.submit(carrier.limits).result(),
+                         scan is not None)
+    shown = {}
+    history = PositionHistory(HISTORY_SIZE)
+    drawn = {}
+    next_draw = monotonic()
+    while True:
+        event, values = window.read(timeout=FRAME_TIMEOUT)
+
+        # if user closes window or clicks shutdown
+        if event == sg.WIN_CLOSED or event == 'Shutdown':
+            if address is not None:
+                # The server keeps the gantry for its other clients
+                worker.close()
+                break
+            # shutdown the carrier once the queued commands are done
+            worker.submit(carrier.shutdown).result()
+            worker.stop()
+            break
+
+        handle_event(worker, event, values, scan, measure)
+        update_status(window, worker.status(), shown, history)
+        # Redraw at a fixed rate, independent of the poll rate
+        if monotonic() >= next_draw:
+            update_plot(window, history, scan, drawn)
+            next_draw = monotonic() + PLOT_INTERVAL
+
+    window.close()
+
+
+if __name__ == '__main__':
+    # "python MapperGUI.py --server" shares the gantry of a running server.py
+    main(address=DEFAULT_ADDRESS if '--server' in sys.argv[1:] else None)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio front end of linact.Carrier.
+
+AsyncCarrier drives a Carrier's serial connection from an event loop. It
+reuses the Carrier for command encoding, limit checks and the position
+and settings caches, but all I/O is awaitable: a single reader task
+splits the incoming bytes into '\\r'-terminated replies and resolves the
+futures of the waiting commands in the order they were sent, checking
+that every reply echoes the address and opcode of its command. Queries
+issued concurrently (e.g. with asyncio.gather) share one round trip.
+
+    carrier = await AsyncCarrier.open()
+    await carrier.initialize()
+    await carrier.move_to_xyz(10.0, 5.0, 0.0, wait=True)
+    await carrier.shutdown()
+
+The Carrier must not be used directly while an AsyncCarrier runs it.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
+
+from linact import (AXES, CACHED_PARAMETERS, ERROR, POWER_MODE, STOP_ALL,
+                    TERMINATOR, ZERO_HERE, Carrier, answers, reply_echoes)
+from periphery import ResponseTimeoutException
+
+
+class AsyncCarrier:
+    """Awaitable motion and query API on top of a Carrier"""
+
+    def __init__(self, carrier: Carrier):
+        self.carrier = carrier
+        self.logger = carrier.logger
+        # [future, command line, echoes of the replies still expected,
+        #  replies received so far]
+        self._waiting = deque()
+        self._buffer = bytearray()
+        self._reader = None
+        self._executor = None
+        # Moves are planned from the tracked positions, one at a time
+        self._motion_lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, **kwargs):
+        """Create the Carrier (kwargs as for Carrier) off the event loop"""
+        loop = asyncio.get_running_loop()
+        carrier = await loop.run_in_executor(None, lambda: Carrier(**kwargs))
+        return cls(carrier)
+
+    async def start(self):
+        """Start the reader task, done implicitly by the first command"""
+        if self._reader is None:
+            # Blocking port reads happen on one dedicated thread
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='AsyncCarrier')
+            self._reader = asyncio.get_running_loop().create_task(
+                self._read_loop())
+
+    async def close(self):
+        """Stop the reader task and fail all commands still waiting"""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+            self._executor.shutdown(wait=True)
+        while self._waiting:
+            future = self._waiting.popleft()[0]
+            if not future.done():
+                future.cancel()
+
+    async def command(self, data: bytes, timeout: float = None) -> bytes:
+        """Send a command line and return all of its replies"""
+        await self.start()
+        if timeout is None:
+            timeout = self.carrier.constants["read_timeout"]
+        future = asyncio.get_running_loop().create_future()
+        entry = [future, data, deque(reply_echoes(data) or [None]),
+                 bytearray()]
+        self._waiting.append(entry)
+        sent = perf_counter()
+        self.carrier.serial_connection.write(data)
+        stats = self.carrier.stats
+        try:
+            received = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # A late reply no longer matches any command and is dropped
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            if stats is not None:
+                stats.record(data, 0)
+            raise ResponseTimeoutException(
+                {'command': data, 'timeout': timeout},
+                'No complete reply from the motion controller')
+        if stats is not None:
+            stats.record(data, len(received), perf_counter() - sent)
+        return received
+
+    async def _read_loop(self):
+        loop = asyncio.get_running_loop()
+        connection = self.carrier.serial_connection
+        while True:
+            chunk = await loop.run_in_executor(
+                self._executor,
+                lambda: connection.read(max(1, connection.in_waiting)))
+            if chunk:
+                self._feed(chunk)
+
+    def _feed(self, chunk: bytes):
+        """Hand complete replies to the waiting commands they echo"""
+        buffer = self._buffer
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(TERMINATOR, start) + 1
+            if not end:
+                break
+            reply = buffer[start:end]
+            start = end
+            entry = self._match(reply)
+            if entry is None:
+                self.logger.warning("Unexpected reply %s", bytes(reply))
+                continue
+            entry[2].popleft()
+            entry[3] += reply
+            if not entry[2]:
+                self._waiting.popleft()
+                if not entry[0].done():
+                    entry[0].set_result(bytes(entry[3]))
+        del buffer[:start]
+
+    def _match(self, reply: bytes) -> list:
+        """The oldest waiting command a reply belongs to, None if there is
+        none. The controller answers in order, so the commands before it
+        lost their replies and fail"""
+        for position, entry in enumerate(self._waiting):
+            echo = entry[2][0]
+            if echo is None or answers(reply, echo):
+                for _ in range(position):
+                    future, data = self._waiting.popleft()[:2]
+                    if not future.done():
+                        future.set_exception(ResponseTimeoutException(
+                            {'command': data, 'received': bytes(reply)},
+                            'Reply lost'))
+                return entry
+        return None
+
+    # Motion
+    async def initialize(self, resume: bool = True):
+        """Open port and initialize starting position. Resumes from the
+        Carrier's journal like Carrier.initialize"""
+        carrier = self.carrier
+        self.logger.info("Initializing...")
+        if not carrier.serial_connection.is_open:
+            carrier.serial_connection.open()
+        resumed = resume and carrier.journal is not None and \
+            await self._resume()
+        if not resumed:
+            for parameter in CACHED_PARAMETERS:
+                carrier.parameters[parameter] = [None] * len(AXES)
+        # Power and step mode cannot be read back, so they are always sent
+        self.logger.debug("Received: %s", await self.command(POWER_MODE))
+        if not resumed:
+            self.logger.debug("Received: %s", await self.command(ZERO_HERE))
+            carrier._zeroed()
+        begin, end = carrier.profile_velocities()
+        await self._set_axis_parameter("begin_velocity", "B", begin)
+        await self._set_axis_parameter("end_velocity", "E", end)
+        await self._set_axis_parameter("microstep", "H", [3] * len(AXES),
+                                       force=True)
+        carrier._configured = True
+        carrier._journal_state('resume' if resumed else 'initialize',
+                               reset=True)
+
+    async def _resume(self) -> bool:
+        """See Carrier._resume. The queries go out concurrently"""
+        carrier = self.carrier
+        state = carrier._resumable_state()
+        if state is None:
+            return False
+        lines = carrier._resume_lines()
+        replies = await asyncio.gather(*(self.command(line)
+                                         for line in lines))
+        return carrier._adopt(state, lines, replies)
+
+    async def shutdown(self):
+        """Set to starting position, close port"""
+        self.logger.info("Shutting down")
+        # The controller refuses moves while an axis is still busy
+        await self.wait_until_idle()
+        homed = await self.move_to_xyz(0.0, 0.0, 0.0, wait=True)
+        await self.close()
+        if homed:
+            # A closed session is never resumed
+            self.carrier._configured = False
+            self.carrier._journal_state('shutdown')
+        else:
+            # The journal keeps the last known state to resume from
+            self.logger.error("The carrier did not return home")
+        self.carrier.serial_connection.close()
+        if self.carrier.journal is not None:
+            self.carrier.journal.close()
+
+    async def move_to(self, new_position: float, axis: int,
+                      wait: bool = False) -> bool:
+        positions = [None] * len(AXES)
+        positions[axis] = new_position
+        return await self.move_to_xyz(*positions, wait=wait)
+
+    async def move_to_xyz(self, x: float = None, y: float = None,
+                          z: float = None, wait: bool = False) -> bool:
+        """See Carrier.move_to_xyz"""
+        carrier = self.carrier
+        positions = (x, y, z)
+        moving = carrier._plan_move(positions)
+        if moving is None:
+            return False
+        async with self._motion_lock:
+            await asyncio.gather(*(self.sync_position(axis)
+                                   for axis in moving
+                                   if carrier._needs_sync(axis)))
+            steps = {axis: count for axis, count
+                     in carrier._move_steps(positions, moving).items()
+                     if count}
+            if steps and not carrier._track_moves(
+                    steps, await self.command(carrier._move_line(steps))):
+                return False
+        return await self.wait_until_idle(moving) if wait else True
+
+    async def move_by_xyz(self, dx: float = 0.0, dy: float = 0.0,
+                          dz: float = 0.0, wait: bool = False) -> bool:
+        offsets = (dx, dy, dz)
+        positions = [await self.get_position(axis) + offsets[axis]
+                     if offsets[axis] else None
+                     for axis in range(len(AXES))]
+        return await self.move_to_xyz(*positions, wait=wait)
+
+    async def wait_until_idle(self, axes=None, timeout: float = None) -> bool:
+        """See Carrier.wait_until_idle. Polls the axes concurrently"""
+        carrier = self.carrier
+        pending, finish, deadline, rest = carrier._idle_schedule(axes,
+                                                                 timeout)
+        if rest > 0:
+            await asyncio.sleep(rest)
+        delay = carrier.constants["min_poll_delay"]
+        last = {}
+        while pending:
+            axes = list(pending)
+            positions = await asyncio.gather(*(self._query_steps(axis)
+                                               for axis in axes))
+            for axis, position in zip(axes, positions):
+                carrier._arrived(pending, axis, position, last, finish)
+            if not pending:
+                break
+            if monotonic() + delay > deadline:
+                carrier._missed(pending)
+                return False
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, carrier.constants["max_poll_delay"])
+        return True
+
+    async def stop(self):
+        self.logger.info("Stop signal received. Stopping the motors")
+        self.logger.debug("Received: %s", await self.command(STOP_ALL))
+        self.carrier._stopped()
+
+    # Queries
+    async def get_position(self, axis: int, refresh: bool = False) -> float:
+        """See Carrier.get_position"""
+        carrier = self.carrier
+        if carrier._steps[axis] is None:
+            await self.sync_position(axis)
+        elif refresh:
+            return carrier._live_position(axis,
+                                          await self._query_steps(axis))
+        return carrier.get_position(axis)
+
+    async def sync_position(self, axis: int = None):
+        axes = range(len(AXES)) if axis is None else (axis,)
+        counters = await asyncio.gather(*(self._query_steps(index)
+                                          for index in axes))
+        for index, steps in zip(axes, counters):
+            self.carrier._steps[index] = steps
+            self.carrier._moves_since_sync[index] = 0
+
+    async def _query_steps(self, axis: int) -> int:
+        line = self.carrier._query_line(axis, 'm')
+        return self.carrier._to_steps(await self.command(line), line)
+
+    # Settings
+    async def set_begin_velocity(self, axis: int, velocity: int) -> bool:
+        values = [None] * len(AXES)
+        values[axis] = velocity
+        return await self._set_axis_parameter("begin_velocity", "B", values)
+
+    async def set_end_velocity(self, axis: int, velocity: int) -> bool:
+        values = [None] * len(AXES)
+        values[axis] = velocity
+        return await self._set_axis_parameter("end_velocity", "E", values)
+
+    async def get_begin_velocity(self, axis: int,
+                                 refresh: bool = False) -> int:
+        return await self._get_axis_parameter("begin_velocity", "b", axis,
+                                              refresh)
+
+    async def get_end_velocity(self, axis: int, refresh: bool = False) -> int:
+        return await self._get_axis_parameter("end_velocity", "e", axis,
+                                              refresh)
+
+    async def _set_axis_parameter(self, parameter: str, opcode: str, values,
+                                  force: bool = False) -> bool:
+        carrier = self.carrier
+        changes = carrier._setting_changes(parameter, values, force)
+        if not changes:
+            return changes is not None
+        try:
+            received = await self.command(carrier._setting_line(opcode,
+                                                                changes))
+        except ResponseTimeoutException:
+            carrier._forget_settings(parameter, changes)
+            raise
+        return carrier._track_settings(parameter, changes, received)
+
+    async def _get_axis_parameter(self, parameter: str, opcode: str,
+                                  axis: int, refresh: bool = False):
+        carrier = self.carrier
+        cache = carrier.parameters[parameter]
+        if refresh or cache[axis] is None:
+            line = carrier._query_line(axis, opcode)
+            received = await self.command(line)
+            cache[axis] = None if ERROR in received \
+                else carrier._to_steps(received, line)
+        return cache[axis]
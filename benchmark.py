@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible benchmarks of the Carrier against the simulator.
+
+Every benchmark drives a Carrier over a SimpleStepSimulator with a fixed
+reply latency and baud rate, so numbers only depend on the code and the
+machine. Measured are the round trip of single queries, moves per second
+for single axis and three axis sequences, initialize and shutdown, and
+one iteration of the MapperGUI event loop (status update and plot
+redraw, without the window toolkit's own drawing).
+
+Results are written as JSON. With a baseline file, every result is
+compared against it and regressions beyond the threshold are reported;
+the exit status is then 1.
+
+    python benchmark.py --output before.json
+    ... change something ...
+    python benchmark.py --baseline before.json --output after.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+from datetime import datetime
+from time import monotonic, perf_counter
+
+import numpy as np
+
+from linact import Carrier, AXES
+from simulator import SimpleStepSimulator
+from worker import CarrierWorker
+
+# Default number of timed repetitions per benchmark
+REPEATS = 50
+# Default length in cm of the benchmark moves
+DISTANCE = 0.05
+# Relative change of a result that counts as a regression
+THRESHOLD = 0.10
+
+
+def make_carrier(latency: float, baudrate: int, initialize: bool = True):
+    """Carrier on a fresh simulator, with the default velocities"""
+    carrier = Carrier(serial_connection=SimpleStepSimulator(
+        latency=latency, baudrate=baudrate))
+    if initialize:
+        carrier.initialize()
+    return carrier
+
+
+def summarize(durations, unit: str = 's') -> dict:
+    """Statistics of a list of durations in seconds. The median is the
+    value compared against a baseline"""
+    ordered = sorted(durations)
+    return {'value': statistics.median(ordered), 'unit': unit,
+            'better': 'lower', 'mean': statistics.mean(ordered),
+            'p95': ordered[min(len(ordered) - 1,
+                               int(0.95 * len(ordered)))],
+            'min': ordered[0], 'max': ordered[-1], 'samples': len(ordered)}
+
+
+def rate(count: int, elapsed: float, unit: str) -> dict:
+    return {'value': count / elapsed, 'unit': unit, 'better': 'higher',
+            'elapsed': elapsed, 'samples': count}
+
+
+def timed(function, repeats: int) -> list:
+    durations = []
+    for _ in range(repeats):
+        began = perf_counter()
+        function()
+        durations.append(perf_counter() - began)
+    return durations
+
+
+def bench_queries(carrier: Carrier, repeats: int) -> dict:
+    """Round trip of queries that go to the controller"""
+    return {
+        'query.get_position': summarize(timed(
+            lambda: carrier.get_position(0, refresh=True), repeats)),
+        'query.get_end_velocity': summarize(timed(
+            lambda: carrier.get_end_velocity(0, refresh=True), repeats))}
+
+
+def bench_moves(carrier: Carrier, repeats: int,
+                distance: float = DISTANCE) -> dict:
+    """Back and forth moves, each waited for"""
+    results = {}
+    sequences = {'single_axis': lambda target: carrier.move_to(
+                     target, 0, wait=True),
+                 'three_axis': lambda target: carrier.move_to_xyz(
+                     target, target, target, wait=True)}
+    for name, move in sequences.items():
+        move(0.0)
+        began = perf_counter()
+        for repeat in range(repeats):
+            move(distance if repeat % 2 == 0 else 0.0)
+        results['moves.' + name] = rate(repeats, perf_counter() - began,
+                                        'moves/s')
+    return results
+
+
+def bench_lifecycle(latency: float, baudrate: int, repeats: int,
+                    distance: float = DISTANCE) -> dict:
+    """initialize and shutdown, each on a fresh carrier. shutdown starts
+    away from the origin, so it has to send the move home"""
+    initialize = []
+    shutdown = []
+    for _ in range(repeats):
+        carrier = make_carrier(latency, baudrate, initialize=False)
+        initialize.extend(timed(carrier.initialize, 1))
+        carrier.move_to_xyz(distance, distance, distance, wait=True)
+        shutdown.extend(timed(carrier.shutdown, 1))
+    return {'lifecycle.initialize': summarize(initialize),
+            'lifecycle.shutdown': summarize(shutdown)}
+
+
+class _Element:
+    """Stands in for a PySimpleGUI element: takes the calls, draws nothing"""
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def erase(self):
+        pass
+
+    def draw_point(self, *args, **kwargs):
+        pass
+
+    def draw_lines(self, *args, **kwargs):
+        pass
+
+
+class _Window(dict):
+    def __missing__(self, key):
+        element = self[key] = _Element()
+        return element
+
+
+def bench_gui(carrier: Carrier, repeats: int) -> dict:
+    """One MapperGUI frame without window.read: event handling, status
+    update and a full plot redraw with a scan overlay. Needs PySimpleGUI,
+    which MapperGUI imports"""
+    try:
+        import MapperGUI
+    except ImportError as exception:
+        return {'gui.frame': {'skipped': str(exception)}}
+    from history import PositionHistory
+    from scan import Scan
+    worker = CarrierWorker(carrier, status_interval=0.01)
+    worker.start()
+    try:
+        window = _Window()
+        shown = {}
+        history = PositionHistory(MapperGUI.HISTORY_SIZE)
+        # Fill the history as a long session would
+        now = monotonic()
+        for sample in range(MapperGUI.HISTORY_SIZE):
+            history.append(now + sample, [0.0] * len(AXES))
+        scan = Scan(carrier, np.random.default_rng(0).uniform(
+            0.0, 10.0, (2000, len(AXES))))
+        scan.visited[:1000] = True
+
+        def frame():
+            MapperGUI.handle_event(worker, '__TIMEOUT__', {})
+            MapperGUI.update_status(window, worker.status(), shown, history)
+            MapperGUI.update_plot(window, history, scan)
+
+        return {'gui.frame': summarize(timed(frame, repeats))}
+    finally:
+        worker.stop()
+        worker.join()
+
+
+def run(latency: float = 0.002, baudrate: int = 115200,
+        repeats: int = REPEATS, distance: float = DISTANCE) -> dict:
+    """Run all benchmarks, returns the results document"""
+    results = {}
+    carrier = make_carrier(latency, baudrate)
+    results.update(bench_queries(carrier, repeats))
+    results.update(bench_moves(carrier, repeats, distance))
+    results.update(bench_gui(carrier, repeats))
+    results.update(bench_lifecycle(latency, baudrate, max(1, repeats // 5),
+                                   distance))
+    return {'meta': {'date': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'latency': latency, 'baudrate': baudrate,
+                     'repeats': repeats, 'distance': distance},
+            'results': results}
+
+
+def compare(current: dict, baseline: dict,
+            threshold: float = THRESHOLD) -> list:
+    """(name, baseline, current, relative change, regressed) per result
+    found in both documents. The change is positive when it got better"""
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or 'value' not in before or 'value' not in result:
+            continue
+        change = (result['value'] - before['value']) / before['value']
+        if result['better'] == 'lower':
+            change = -change
+        rows.append((name, before['value'], result['value'], change,
+                     change < -threshold))
+    return rows
+
+
+def print_comparison(rows, current: dict, baseline: dict):
+    settings = ('latency', 'baudrate', 'repeats', 'distance')
+    differing = [key for key in settings
+                 if current['meta'].get(key) != baseline['meta'].get(key)]
+    if differing:
+        print("Warning: baseline was run with other settings: " +
+              ', '.join(differing))
+    print("{0:<26} {1:>12} {2:>12} {3:>8}".format(
+        'benchmark', 'baseline', 'current', 'change'))
+    for name, before, after, change, regressed in rows:
+        print("{0:<26} {1:>12.6g} {2:>12.6g} {3:>+7.1%}{4}".format(
+            name, before, after, change, '  REGRESSION' if regressed else ''))
+
+
+def print_results(document: dict):
+    for name, result in document['results'].items():
+        if 'skipped' in result:
+            print("{0:<26} skipped: {1}".format(name, result['skipped']))
+        else:
+            print("{0:<26} {1:>12.6g} {2}".format(name, result['value'],
+                                                  result['unit']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Carrier against the simulator')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='simulated reply latency in seconds')
+    parser.add_argument('--baudrate', type=int, default=115200,
+                        help='simulated baud rate')
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help='timed repetitions per benchmark')
+    parser.add_argument('--distance', type=float, default=DISTANCE,
+                        help='length in cm of the benchmark moves')
+    parser.add_argument('--output', metavar='JSON',
+                        help='file to write the results to')
+    parser.add_argument('--baseline', metavar='JSON',
+                        help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative change counted as a regression')
+    arguments = parser.parse_args()
+    document = run(arguments.latency, arguments.baudrate, arguments.repeats,
+                   arguments.distance)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(document, file, indent=2)
+    print_results(document)
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        rows = compare(document, baseline, arguments.threshold)
+        print()
+        print_comparison(rows, document, baseline)
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Several gantries driven from one host.
+
+CarrierGroup opens one Carrier per attached motion controller (or per
+given serial number / port) and runs their initialize and shutdown
+sequences in parallel, so startup takes as long as the slowest
+controller instead of the sum of all.
+
+    group = CarrierGroup.discover()
+    group.initialize()
+    group[0].move_to(10.0, 0)
+    group.shutdown()
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from linact import Carrier, find_controllers
+
+
+class CarrierGroup:
+    """Manages several Carrier instances together"""
+
+    def __init__(self, carriers):
+        self.carriers = list(carriers)
+        self.logger = logging.getLogger('MainLogger.CarrierGroup')
+
+    @classmethod
+    def discover(cls, serial_numbers=None, ports=None, refresh: bool = False,
+                 **kwargs):
+        """One Carrier per given serial number or port, by default one per
+        attached controller. kwargs are passed on to every Carrier"""
+        carriers = []
+        if ports is not None:
+            carriers += [Carrier(name='Linear Actuator {0}'.format(port),
+                                 port=port, **kwargs) for port in ports]
+        if serial_numbers is None and ports is None:
+            serial_numbers = [device.serial_number
+                              for device in find_controllers(refresh)]
+        for number in serial_numbers or ():
+            carriers.append(Carrier(name='Linear Actuator {0}'.format(number),
+                                    serial_number=number, **kwargs))
+        return cls(carriers)
+
+    def __len__(self):
+        return len(self.carriers)
+
+    def __iter__(self):
+        return iter(self.carriers)
+
+    def __getitem__(self, index):
+        return self.carriers[index]
+
+    def initialize(self) -> list:
+        """Initialize all carriers in parallel"""
+        return self.map(Carrier.initialize)
+
+    def shutdown(self) -> list:
+        """Shut down all carriers in parallel"""
+        return self.map(Carrier.shutdown)
+
+    def map(self, function, *args, **kwargs) -> list:
+        """Call function(carrier, *args, **kwargs) for every carrier on a
+        thread pool and return the results in carrier order. Every call
+        runs to completion; the first exception is raised afterwards"""
+        if not self.carriers:
+            return []
+        with ThreadPoolExecutor(max_workers=len(self.carriers)) as pool:
+            futures = [pool.submit(function, carrier, *args, **kwargs)
+                       for carrier in self.carriers]
+        errors = [future.exception() for future in futures
+                  if future.exception() is not None]
+        for error in errors:
+            self.logger.error("Carrier call failed: %s", error)
+        if errors:
+            raise errors[0]
+        return [future.result() for future in futures]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-size history of timestamped carrier positions.
+
+PositionHistory preallocates a (capacity, 4) array of (t, x, y, z) rows
+and overwrites the oldest row once it is full, so memory stays the same
+however long a session runs. decimated() thins the history to a fixed
+number of rows for drawing, whatever the sample rate was.
+
+    history = PositionHistory(capacity=20000)
+    history.append(status['time'], status['position'])
+    trajectory = history.decimated(500)
+"""
+
+import numpy as np
+
+
+class PositionHistory:
+    """Ring buffer of (t, x, y, z) samples, oldest overwritten first"""
+
+    def __init__(self, capacity: int = 10000):
+        self._data = np.full((capacity, 4), np.nan)
+        self._next = 0
+        self._count = 0
+        # Increases with every sample, lets readers skip unchanged data
+        self.version = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    def append(self, time: float, position):
+        """Store a sample. Unknown coordinates (None) are kept as NaN"""
+        row = self._data[self._next]
+        row[0] = time
+        row[1:] = [np.nan if value is None else value for value in position]
+        self._next = (self._next + 1) % len(self._data)
+        self._count = min(self._count + 1, len(self._data))
+        self.version += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+        self.version += 1
+
+    def array(self) -> np.ndarray:
+        """All samples, oldest first"""
+        if self._count < len(self._data):
+            return self._data[:self._count].copy()
+        return np.roll(self._data, -self._next, axis=0)
+
+    def last(self) -> np.ndarray:
+        """The newest sample, None if there is none"""
+        if not self._count:
+            return None
+        return self._data[self._next - 1].copy()
+
+    def decimated(self, points: int) -> np.ndarray:
+        """At most points samples spread evenly over the history, always
+        including the newest one"""
+        samples = self.array()
+        if len(samples) <= points:
+            return samples
+        stride = -(-len(samples) // points)
+        return samples[::-1][::stride][::-1]
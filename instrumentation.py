@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Per-command traffic and latency statistics of a Carrier.
+
+Commands are grouped by type, the axis letters and opcodes of a command
+line (e.g. "Xm" for a position query, "XR,YR,ZR" for a combined move).
+Round-trip latencies go into a fixed log-spaced histogram, so recording
+costs a bisect and memory stays constant however long a session runs.
+
+    stats = carrier.instrument()
+    ...
+    stats.to_csv('latency.csv')
+    stats.to_prometheus('carrier.prom')
+"""
+
+import csv
+import os
+import re
+import threading
+from bisect import bisect_left
+
+# Axis letter and opcode of every addressed command in a line
+_TYPE_RE = re.compile(rb'(?:^|,)([XYZ])\d([A-Za-z*])')
+# Upper bucket edges in seconds, ten per decade from 100 us to 10 s
+BUCKETS = tuple(1e-4 * 10 ** (index / 10) for index in range(51))
+
+
+def command_type(data: bytes) -> str:
+    """Axis letters and opcodes of a command line, e.g. 'XR,YR'"""
+    return ','.join((axis + opcode).decode()
+                    for axis, opcode in _TYPE_RE.findall(data)) or '?'
+
+
+class _Entry:
+    __slots__ = ('count', 'timeouts', 'bytes_out', 'bytes_in', 'total',
+                 'maximum', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        # One extra bucket for everything beyond the last edge
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper edge of the bucket holding the given fraction of samples,
+        capped at the largest latency seen"""
+        answered = self.count - self.timeouts
+        if not answered:
+            return None
+        needed = fraction * answered
+        cumulative = 0
+        for index, count in enumerate(self.histogram):
+            cumulative += count
+            if cumulative >= needed:
+                if index < len(BUCKETS):
+                    return min(BUCKETS[index], self.maximum)
+                return self.maximum
+        return self.maximum
+
+
+class CommandStats:
+    """Counts, bytes and round-trip latency histogram per command type"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, data: bytes, received: int, latency: float = None):
+        """Account for a command line and its reply. A latency of None
+        marks a command that timed out"""
+        key = command_type(data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            entry.count += 1
+            entry.bytes_out += len(data)
+            entry.bytes_in += received
+            if latency is None:
+                entry.timeouts += 1
+                return
+            entry.total += latency
+            entry.maximum = max(entry.maximum, latency)
+            entry.histogram[bisect_left(BUCKETS, latency)] += 1
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> dict:
+        """Summary per command type: count, timeouts, bytes in and out,
+        mean, p50, p95, p99 and maximum latency in seconds"""
+        with self._lock:
+            summary = {}
+            for key, entry in sorted(self._entries.items()):
+                answered = entry.count - entry.timeouts
+                summary[key] = {
+                    'count': entry.count,
+                    'timeouts': entry.timeouts,
+                    'bytes_out': entry.bytes_out,
+                    'bytes_in': entry.bytes_in,
+                    'mean': entry.total / answered if answered else None,
+                    'p50': entry.percentile(0.50),
+                    'p95': entry.percentile(0.95),
+                    'p99': entry.percentile(0.99),
+                    'max': entry.maximum,
+                }
+            return summary
+
+    def to_csv(self, path: str):
+        """Write the snapshot as one CSV row per command type"""
+        fields = ['command', 'count', 'timeouts', 'bytes_out', 'bytes_in',
+                  'mean', 'p50', 'p95', 'p99', 'max']
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            for key, values in self.snapshot().items():
+                writer.writerow(dict(values, command=key))
+
+    def to_prometheus(self, path: str, prefix: str = 'carrier'):
+        """Write the statistics in the Prometheus text format. The file is
+        replaced atomically, as node_exporter's textfile collector expects"""
+        with self._lock:
+            entries = sorted(self._entries.items())
+            lines = []
+            for name, kind, attribute, text in (
+                    ('commands_total', 'counter', 'count', 'Commands sent'),
+                    ('timeouts_total', 'counter', 'timeouts',
+                     'Commands without a reply'),
+                    ('bytes_out_total', 'counter', 'bytes_out', 'Bytes sent'),
+                    ('bytes_in_total', 'counter', 'bytes_in',
+                     'Bytes received')):
+                lines.append('# HELP {0}_{1} {2}'.format(prefix, name, text))
+                lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+                for key, entry in entries:
+                    lines.append('{0}_{1}{{command="{2}"}} {3}'.format(
+                        prefix, name, key, getattr(entry, attribute)))
+            name = prefix + '_latency_seconds'
+            lines.append('# HELP {0} Command round-trip latency'.format(name))
+            lines.append('# TYPE {0} histogram'.format(name))
+            for key, entry in entries:
+                cumulative = 0
+                for edge, count in zip(BUCKETS + (float('inf'),),
+                                       entry.histogram):
+                    cumulative += count
+                    lines.append('{0}_bucket{{command="{1}",le="{2}"}} {3}'
+                                 .format(name, key,
+                                         '+Inf' if edge == float('inf')
+                                         else '{0:.6g}'.format(edge),
+                                         cumulative))
+                lines.append('{0}_sum{{command="{1}"}} {2}'.format(
+                    name, key, entry.total))
+                lines.append('{0}_count{{command="{1}"}} {2}'.format(
+                    name, key, cumulative))
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temporary, path)
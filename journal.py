@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of a Carrier's state.
+
+Every line is a JSON snapshot of what the controller was last told: the
+commanded step counters and the acknowledged settings of all axes, plus
+the event that produced it. Only the last complete line matters, so a
+line cut short by a crash is simply ignored. The file is rewritten with
+a single line whenever a session starts and every compact_every
+snapshots, which keeps it small.
+
+    {"event": "move", "configured": true, "steps": [-3200, 0, 0],
+     "begin_velocity": [100, 100, 100], "end_velocity": [6000, ...], ...}
+"""
+
+import json
+import os
+
+# Bytes last() reads at a time, from the end of the file
+_BLOCK = 4096
+
+
+class MotionJournal:
+    """Snapshots of the carrier state, one JSON object per line"""
+
+    def __init__(self, path: str, compact_every: int = 1000):
+        self.path = path
+        self.compact_every = compact_every
+        self._file = None
+        self._lines = 0
+
+    def last(self) -> dict:
+        """The latest complete snapshot, None if there is none. Reads
+        the file backwards, only as far as needed"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as file:
+            end = file.seek(0, os.SEEK_END)
+            partial = b''
+            while end > 0:
+                start = max(0, end - _BLOCK)
+                file.seek(start)
+                lines = (file.read(end - start) + partial).splitlines()
+                end = start
+                # The first line may continue in the block before
+                partial = lines.pop(0) if start and lines else b''
+                for line in reversed(lines):
+                    try:
+                        return json.loads(line)
+                    except ValueError:
+                        continue
+        return None
+
+    def reset(self, state: dict):
+        """Replace the journal by a single snapshot"""
+        self.close()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(json.dumps(state) + '\n')
+        os.replace(temporary, self.path)
+        self._lines = 1
+
+    def append(self, state: dict):
+        """Add a snapshot. Every compact_every of them the journal is
+        replaced by the latest one instead"""
+        if self._lines >= self.compact_every:
+            self.reset(state)
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(state) + '\n')
+        self._file.flush()
+        self._lines += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -6,11 +6,23 @@ Created on Fri Apr  3 20:56:24 2020
 University of Winnipeg
 """
 
-from time import sleep
+import functools
+import json
+import os
+import re
+import threading
+from array import array
+from collections import deque
+from time import monotonic, perf_counter
 import serial
 from serial.tools.list_ports import comports
 
-from periphery import Periphery, OutOfLimitException
+import motion
+from instrumentation import CommandStats
+from journal import MotionJournal
+from periphery import (Periphery, OutOfLimitException,
+                       ReplyMismatchException, ResponseTimeoutException,
+                       StoppedException)
 
 
 #   Constants
@@ -36,11 +48,104 @@ from periphery import Periphery, OutOfLimitException
 # Axes names
 # AXES = ('X', 'Y', 'Z')
 # AXES_B = (b'X', b'Y', b'Z')
+# Every reply of the controller ends with a carriage return
+TERMINATOR = b'\r'
+# One addressed command (e.g. "X0m") inside a comma-joined command line
+_COMMAND_RE = re.compile(rb'(?:^|,)[XYZ]\d')
+# Address and opcode of a command, repeated at the start of its reply
+_ECHO_RE = re.compile(rb'(?:^|,)([XYZ]\d[A-Za-z*])')
+# Marks a rejected command in a reply
+ERROR = b'?'
+AXES = ('X', 'Y', 'Z')
+# Controller step counters run against the cm axes for X and Y
+AXIS_SIGN = (-1, -1, 1)
+# Per-axis settings mirrored in Carrier.parameters
+CACHED_PARAMETERS = ("begin_velocity", "end_velocity", "microstep")
+# Command lines shared by the synchronous and asynchronous carriers
+POWER_MODE = b'X0P3,128,17,0,Y0P3,128,17,0,Z0P3,128,17,0\r'
+# Null (Zero/Home) Motor + Clockwise + Ignore the home sensor
+ZERO_HERE = b'X0N+0S,Y0N+0S,Z0N+0S\r'
+STOP_ALL = b'X0*,Y0*,Z0*\r'
+# USB product id of the SimpleStep controllers
+CONTROLLER_PID = 21
+# Default file of the begin/end velocities per axis written by tuning.tune,
+# read by initialize of a Carrier created with profile=VELOCITY_PROFILE
+VELOCITY_PROFILE = 'velocity_profile.json'
+
+# Result of the last port scan and ports opened by a Carrier
+_discovered = None
+_claimed_ports = set()
+_discovery_lock = threading.Lock()
+
+
+def expected_replies(data: bytes) -> int:
+    """Number of replies a command line is answered with"""
+    return len(_COMMAND_RE.findall(data))
+
+
+def reply_echoes(data: bytes) -> list:
+    """Address and opcode each reply to a command line starts with, e.g.
+    [b'X0R', b'Y0R'] for b'X0RNY+10,Y0RNY-5\\r'"""
+    return _ECHO_RE.findall(data)
+
+
+def answers(reply: bytes, echo: bytes) -> bool:
+    """Whether a single reply belongs to the command with the given echo.
+    A rejection (b'X0?') answers any command of its address"""
+    return reply[:2] == echo[:2] and reply[2:3] in (echo[2:3], ERROR)
+
+
+def load_velocity_profile(path: str) -> dict:
+    """Begin and end velocity per axis letter from a profile file, e.g.
+    {'X': {'begin_velocity': 400, 'end_velocity': 9000}, ...}"""
+    with open(path) as file:
+        profile = json.load(file)
+    return {axis: {parameter: int(value)
+                   for parameter, value in profile[axis].items()
+                   if parameter in ("begin_velocity", "end_velocity")}
+            for axis in AXES if axis in profile}
+
+
+def save_velocity_profile(path: str, profile: dict):
+    """Write a profile as returned by load_velocity_profile. The file is
+    replaced atomically"""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(profile, file, indent=2, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def _transaction(method):
+    """Run a Carrier method under the carrier's lock. A call still waiting
+    for the lock when stop() is called raises StoppedException"""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        stops = self._stops
+        with self._lock:
+            if self._stops != stops:
+                raise StoppedException('{0} cancelled by a stop'.format(
+                    method.__name__))
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def find_controllers(refresh: bool = False) -> list:
+    """Return the port infos of all attached motion controllers. The port
+    scan runs once and is reused until refresh is requested"""
+    global _discovered
+    with _discovery_lock:
+        if _discovered is None or refresh:
+            _discovered = [device for device in comports()
+                           if device.pid == CONTROLLER_PID]
+        return list(_discovered)
 
 # Main class
 class Carrier(Periphery):
 
-    def __init__(self, name: str = 'Linear Actuator', velocity: int = 6000):
+    def __init__(self, name: str = 'Linear Actuator', velocity: int = 6000,
+                 port: str = None, serial_connection=None,
+                 reconcile_every: int = 0, serial_number: str = None,
+                 profile: str = None, journal: str = None):
         constants = {
             "Max_position": 80.0,
             "Min_position": 0.0,
@@ -53,14 +158,69 @@ class Carrier(Periphery):
             "axis_bin_name": b'X', 
             "Max_Z_position": 80.0,
             "Min_Z_position": 0.0,
-            'velocity': 6000
+            'velocity': 6000,
+            # seconds to wait for the reply(ies) to one command line
+            "read_timeout": 1.0,
+            # seconds a single blocking port read may take
+            "poll_interval": 0.01,
+            # steps/s^2 of the velocity ramps between B and E
+            "acceleration": 20000,
+            # share of the predicted move time to sleep before polling
+            "wait_fraction": 0.9,
+            # first and longest pause between position polls in seconds
+            "min_poll_delay": 0.002,
+            "max_poll_delay": 0.05,
+            # command lines pipeline() keeps in flight at once
+            "pipeline_window": 8
         }
         if 0 < velocity <= constants["Max_velocity"]:
             Periphery.__init__(self, name,
-                               {"velocity": velocity}, constants)
+                               {"velocity": velocity,
+                                # re-read positions every N moves, 0: never
+                                "reconcile_every": reconcile_every,
+                                # velocity profile file, None: defaults
+                                "profile": profile,
+                                # last acknowledged settings per axis,
+                                # None if unknown
+                                "begin_velocity": [None] * len(AXES),
+                                "end_velocity": [None] * len(AXES),
+                                "microstep": [None] * len(AXES)},
+                               constants)
             self.logger.debug("Linear actuator booting")
 
-            self.serial_connection = self._connect()
+            # Bytes received but not yet consumed by _read
+            self._rx_buffer = bytearray()
+            # Command lines sent but not read yet, in the order they were
+            # written: [line, number of replies, send time if instrumented,
+            # sending thread, replies once received]
+            self._in_flight = deque()
+            # One thread at a time runs commands, see _transaction
+            self._lock = threading.RLock()
+            # Guards the port writes and _in_flight, held only briefly so
+            # that stop() gets on the wire while another thread is busy
+            self._wire_lock = threading.Lock()
+            # Set while a stop is under way, interrupts waits
+            self._interrupt = threading.Event()
+            self._stops = 0
+            # Seconds from the last stop() call until it was written
+            self.stop_latency = None
+            # MotionJournal of the commanded state, None: not kept
+            self.journal = None if journal is None else MotionJournal(journal)
+            # Whether power mode and origin were set in this session
+            self._configured = False
+            # CommandStats recording every command, None when disabled
+            self.stats = None
+            # Commanded step counters per axis, None until read back
+            self._steps = [None] * len(AXES)
+            self._moves_since_sync = [0] * len(AXES)
+            # Move in progress per axis: (start, predicted duration, target)
+            self._motion = [None] * len(AXES)
+            if serial_connection is None:
+                self.serial_connection = self._connect(port, serial_number)
+            else:
+                # Serial-like object, e.g. simulator.SimpleStepSimulator
+                serial_connection.timeout = self.constants["poll_interval"]
+                self.serial_connection = serial_connection
             if self.serial_connection is None:
                 self.logger.error("Linear actuator not connected")
         else:
@@ -71,110 +231,252 @@ class Carrier(Periphery):
             )
     
     
-    def _connect(self) -> serial.Serial:
-        devices = comports()
-        for device in devices:
-            if device.pid == 21:
-                port_name = device.device
+    def _connect(self, port: str = None,
+                 serial_number: str = None) -> serial.Serial:
+        """Open the given port, else the controller with the given serial
+        number, else the first controller no other Carrier has opened"""
+        if port is not None:
+            self.logger.info("Opening motion controller at {0}".format(port))
+            return self._open(port)
+        # A stale scan result gets one fresh scan before giving up
+        for refresh in (False, True):
+            for device in find_controllers(refresh):
+                if serial_number is not None and \
+                        device.serial_number != serial_number:
+                    continue
+                if serial_number is None and device.device in _claimed_ports:
+                    continue
                 self.logger.info("Motion controller found at {0}".
-                                 format(port_name))
-                serial_connection = serial.Serial(port=port_name,
-                                                  baudrate=115200)
-                break
-        else:
-            # noinspection PyUnusedLocal
-            serial_connection = None
-            self.logger.info("No motion controller found")
-            raise serial.SerialException("")
+                                 format(device.device))
+                try:
+                    return self._open(device.device)
+                except serial.SerialException:
+                    self.logger.warning("Could not open {0}".
+                                        format(device.device))
+        self.logger.info("No motion controller found")
+        raise serial.SerialException("No motion controller found")
+
+    def _open(self, port: str) -> serial.Serial:
+        serial_connection = serial.Serial(
+            port=port, baudrate=115200,
+            timeout=self.constants["poll_interval"])
+        with _discovery_lock:
+            _claimed_ports.add(port)
         return serial_connection
 
     # Initializes the stepper at its current position
-    def initialize(self):
-        """Open port and initialize starting position"""
+    @_transaction
+    def initialize(self, resume: bool = True):
+        """Open port and initialize starting position.
+
+        With a journal and resume, the controller's counters and settings
+        are read back first. If they match the journal, the controller
+        kept its state since the last session: the coordinate frame is
+        kept and only the zeroing is skipped"""
         self.logger.info("Initializing...")
         if not self.serial_connection.is_open:
             self.serial_connection.open()
+        resumed = resume and self.journal is not None and self._resume()
+        if not resumed:
+            # Forget the cached settings, they are all sent again below
+            for parameter in CACHED_PARAMETERS:
+                self.parameters[parameter] = [None] * len(AXES)
 
+        # Power and step mode cannot be read back, so they are always sent
         self.logger.debug("Setting Power Mode")
-        self._write(b'X0P3,128,17,0,Y0P3,128,17,0,Z0P3,128,17,0\r')
-        self.logger.debug("Received: " + str(self._read()))
-
-        self.logger.debug("Initialize origin at current position")
-        self._write(b'X0N+0S,Y0N+0S,Z0N+0S\r')
-        # Null (Zero/Home) Motor + Clockwise + Ignore the home sensor
-        # and initialize the board at its current position
-        self.logger.debug("Received: " + str(self._read()))
-
-        self._set_velocities(self.parameters["velocity"],
-                             self.parameters["velocity"],
-                             self.parameters["velocity"],
-                             self.constants["Start_velocity"],
-                             self.constants["Start_velocity"],
-                             self.constants["Start_velocity"])
+        self._write(POWER_MODE)
+        self.logger.debug("Received: %s", self._read())
+
+        if not resumed:
+            self.logger.debug("Initialize origin at current position")
+            self._write(ZERO_HERE)
+            # Null (Zero/Home) Motor + Clockwise + Ignore the home sensor
+            # and initialize the board at its current position
+            self.logger.debug("Received: %s", self._read())
+            self._zeroed()
+
+        begin, end = self.profile_velocities()
+        self._set_velocities(*end, *begin)
         self.logger.debug("Set 1/8-step mode")
-        self._write(b'X0H3,Y0H3,Z0H3\r')
-        sleep(0.1)
-        self.logger.debug("Received: " + str(self._read()))
+        self._set_axis_parameter("microstep", "H", (3, 3, 3), force=True)
+        self._configured = True
+        self._journal_state('resume' if resumed else 'initialize',
+                            reset=True)
+
+    def _resume(self) -> bool:
+        """Adopt the journaled counters and velocities if the controller
+        still has them. Counters the journal lost (after a stop) are
+        taken from the controller"""
+        state = self._resumable_state()
+        if state is None:
+            return False
+        lines = self._resume_lines()
+        return self._adopt(state, lines, self.pipeline(lines))
+
+    def _resumable_state(self) -> dict:
+        """The journal's last snapshot, None if it cannot be resumed"""
+        state = self.journal.last()
+        if not state or not state.get("configured"):
+            return None
+        return state
+
+    @classmethod
+    def _resume_lines(cls) -> list:
+        """Queries of the counters, begin and end velocities a resume
+        compares against the journal"""
+        return [cls._query_line(axis, opcode) for opcode in 'mbe'
+                for axis in range(len(AXES))]
+
+    def _adopt(self, state: dict, lines, replies) -> bool:
+        """Take over the controller state read by the _resume_lines if it
+        matches the journaled state. Returns whether it did"""
+        if any(ERROR in reply for reply in replies):
+            return False
+        values = [self._to_steps(reply, line)
+                  for line, reply in zip(lines, replies)]
+        read = {"steps": values[:3], "begin_velocity": values[3:6],
+                "end_velocity": values[6:]}
+        # A power cycled controller counts from zero. Zeroing there keeps
+        # the frame anyway, so it is not worth telling the two apart
+        if not any(read["steps"]):
+            return False
+        if any(known is not None and known != value
+               for key in read for known, value in zip(state[key], read[key])):
+            self.logger.info("Controller state differs from the journal, "
+                             "initializing afresh")
+            return False
+        self._steps = read["steps"]
+        self._moves_since_sync = [0] * len(AXES)
+        self._motion = [None] * len(AXES)
+        self.parameters["begin_velocity"] = read["begin_velocity"]
+        self.parameters["end_velocity"] = read["end_velocity"]
+        self.parameters["microstep"] = [None] * len(AXES)
+        self.logger.info("Resumed at step counters %s", self._steps)
+        return True
+
+    def _journal_state(self, event: str, reset: bool = False):
+        """Record the commanded state in the journal, if one is kept"""
+        if self.journal is None:
+            return
+        state = {"event": event, "configured": self._configured,
+                 "steps": list(self._steps)}
+        for parameter in CACHED_PARAMETERS:
+            state[parameter] = list(self.parameters[parameter])
+        if reset:
+            self.journal.reset(state)
+        else:
+            self.journal.append(state)
 
+    def profile_velocities(self) -> tuple:
+        """Begin and end velocities per axis that initialize sets: from
+        the profile file where it has them, else the defaults"""
+        begin = [self.constants["Start_velocity"]] * len(AXES)
+        end = [self.parameters["velocity"]] * len(AXES)
+        path = self.parameters["profile"]
+        if path and os.path.exists(path):
+            self.logger.debug("Loading velocity profile %s", path)
+            profile = load_velocity_profile(path)
+            for axis, name in enumerate(AXES):
+                entry = profile.get(name, {})
+                begin[axis] = entry.get("begin_velocity", begin[axis])
+                end[axis] = entry.get("end_velocity", end[axis])
+        return begin, end
+
+    @_transaction
     def shutdown(self):
         """Set to starting position, close port"""
         self.logger.info("Shutting down")
         # Clear buffer from potentially aborted previous commands
-        self._read()
+        self._flush()
         # TODO: put starting position back to 0.0 once done in home office
-        # shut down all the motors in different x, y, z
-        self.move_to(0.0, 0)
-        self.move_to(0.0, 1)
-        self.move_to(0.0, 2)
+        # The controller refuses moves while an axis is still busy
+        self.wait_until_idle()
+        # return all axes home together
+        if self.move_to_xyz(0.0, 0.0, 0.0, wait=True):
+            # A closed session is never resumed
+            self._configured = False
+            self._journal_state('shutdown')
+        else:
+            # The journal keeps the last known state to resume from
+            self.logger.error("The carrier did not return home")
         self.serial_connection.close()
+        if self.journal is not None:
+            self.journal.close()
+        with _discovery_lock:
+            _claimed_ports.discard(getattr(self.serial_connection, 'port',
+                                           None))
 
-    def move_to(self, new_position: float, axis: int) -> bool:
+    def move_to(self, new_position: float, axis: int,
+                wait: bool = False) -> bool:
         """Moves robot to a given position. Checks software limits.
-        Returns success"""
+        With wait, returns once the move has finished. Returns success"""
+        positions = [None] * len(AXES)
+        positions[axis] = new_position
+        return self.move_to_xyz(*positions, wait=wait)
 
-        # # Flip sign of movement
-        # if axis == 0:
-        #     new_position = -new_position
+    @_transaction
+    def move_to_xyz(self, x: float = None, y: float = None,
+                    z: float = None, wait: bool = False) -> bool:
+        """Moves the given axes to a position together with one command
+        line. Axes left at None stay put. Checks software limits of all
+        axes before anything moves. With wait, returns once the move has
+        finished. Returns success"""
+        positions = (x, y, z)
+        moving = self._plan_move(positions)
+        if moving is None:
+            return False
 
-        # if axis == 1:
-        #     new_position = -new_position
+        # Re-sync tracked positions that are unknown or due
+        for axis in moving:
+            if self._needs_sync(axis):
+                self.sync_position(axis)
+
+        self.logger.debug("Moving robot to coordinates: X=%s, Y=%s, Z=%s cm",
+                          x, y, z)
+        if not self._step(self._move_steps(positions, moving)):
+            return False
+        return self.wait_until_idle(moving) if wait else True
+
+    def _plan_move(self, positions) -> list:
+        """Return the axes to move to the given positions, None if any of
+        them is off limits"""
+        moving = [axis for axis in range(len(AXES))
+                  if positions[axis] is not None]
 
         # Check for coordinates being in-bound
-        if not self._within_limit(new_position, axis):
-            self.logger.warning("You are asking the gantry to go off limit!")
+        off_limit = [AXES[axis] for axis in moving
+                     if not self._within_limit(positions[axis], axis)]
+        if off_limit:
+            self.logger.warning("You are asking the gantry to go off limit "
+                                "on %s!", ', '.join(off_limit))
             self._print_range()
-            return False
+            return None
+        return moving
 
-        # Calculate number of steps to take
-        current_position = self.get_position(axis)
-        x_steps = int((new_position - current_position) *
-                      self.constants["steps_per_cm"])
-        
-        self.logger.debug(
-            "Moving robot to coordinates: X={0}cm.".format(new_position)
-        )
-        if axis == 0:
-            if x_steps >= 0:
-                self._write(bytes('X0RNY-{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('X0RNY+{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-            return True
-        if axis == 1:
-            if x_steps >= 0:
-                self._write(bytes('Y0RNY-{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('Y0RNY+{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-            return True
+    def _needs_sync(self, axis: int) -> bool:
+        """Whether the tracked position is unknown or due for reconciling"""
+        return self._steps[axis] is None or \
+            0 < self.parameters["reconcile_every"] <= \
+            self._moves_since_sync[axis]
 
-        if axis == 2:
-            if x_steps >= 0:
-                self._write(bytes('Z0RNY+{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('Z0RNY-{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-            return True
+    def _move_steps(self, positions, moving) -> dict:
+        """Steps to take per axis from the tracked positions"""
+        steps = {}
+        for axis in moving:
+            target = AXIS_SIGN[axis] * round(positions[axis] *
+                                             self.constants["steps_per_cm"])
+            steps[axis] = target - self._steps[axis]
+        return steps
+
+    @_transaction
+    def move_by_xyz(self, dx: float = 0.0, dy: float = 0.0,
+                    dz: float = 0.0, wait: bool = False) -> bool:
+        """Displaces the carrier on all axes together. Checks software
+        limits. Returns success"""
+        offsets = (dx, dy, dz)
+        return self.move_to_xyz(*(
+            self.get_position(axis) + offsets[axis] if offsets[axis] else None
+            for axis in range(len(AXES))), wait=wait)
 
     def _move(self, cm_to_move: float, axis: int):
         """Displace carrier by given amount. Does not check software limits"""
@@ -183,85 +485,525 @@ class Carrier(Periphery):
 
         # Calculate number of steps to take from current position
         x_steps = int(cm_to_move * self.constants["steps_per_cm"])
-        
-        # Flip sign of movement
-        # if axis == 0:
-        #     cm_to_move = -cm_to_move
-
-        # if axis == 1:
-        #     cm_to_move = -cm_to_move
         print("Moving robot to coordinates: X={0}cm.".format(cm_to_move))
-        if axis == 0:
-            # Moving carrier
-            if x_steps >= 0:
-                self._write(bytes('X0RNY-{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('X0RNY+{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 1:
-            # Moving carrier
-            if x_steps >= 0:
-                self._write(bytes('Y0RNY-{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('Y0RNY+{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 2:
-            # Moving carrier
-            if x_steps >= 0:
-                self._write(bytes('Z0RNY+{0}\r'.format(x_steps), 'utf-8'))
-            else:
-                self._write(bytes('Z0RNY-{0}\r'.format(-x_steps), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
+        self._step({axis: AXIS_SIGN[axis] * x_steps})
 
-    def get_position(self, axis: int) -> float:
-        """Gets position from motor controller in cm"""
-        if axis == 0:
-            self._write(self.constants["axis_bin_name"] + b'0m\r')
-            position = -self._to_cm(self._read())
-            return position
-        if axis == 1:
-            self._write(b'Y' + b'0m\r')
-            position = -self._to_cm(self._read())
-            return position
-        if axis == 2:
-            self._write(b'Z' + b'0m\r')
-            position = self._to_cm(self._read())
-            return position
-
-    def stop(self):
-        self.logger.info("Stop signal received. Stopping the motors")
-        self._write(b'X0*,Y0*,Z0*\r')
-        self.logger.debug("Received:", self._read())
-
-    def _read(self):
-        sleep(0.1)
-        received = b''
-        while self.serial_connection.inWaiting() > 0:
-            received += self.serial_connection.read(1)
-        return received
+    @_transaction
+    def _step(self, steps: dict) -> bool:
+        """Send relative moves in controller steps, given per axis index,
+        as one command line and track them"""
+        steps = {axis: count for axis, count in steps.items() if count}
+        if not steps:
+            return True
+        self._write(self._move_line(steps))
+        return self._track_moves(steps, self._read())
+
+    @staticmethod
+    def _move_line(steps: dict) -> bytes:
+        """Command line moving every axis by its steps"""
+        return bytes(','.join('{0}0RNY{1:+d}'.format(AXES[axis], count)
+                              for axis, count in steps.items()) + '\r',
+                     'utf-8')
+
+    def _track_moves(self, steps: dict, received: bytes) -> bool:
+        """Update the tracked positions from the replies to a move line"""
+        started = monotonic()
+        self.logger.debug("Received: %s", received)
+        success = True
+        replies = self._split_replies(received)
+        for axis, count in steps.items():
+            if ERROR in replies.get(axis, ERROR):
+                # Move rejected: re-sync before the next one
+                self.logger.warning("Move of %s axis rejected", AXES[axis])
+                self._steps[axis] = None
+                success = False
+                continue
+            if self._steps[axis] is not None:
+                self._steps[axis] += count
+            self._moves_since_sync[axis] += 1
+            self._motion[axis] = (started, self.move_time(axis, count),
+                                  self._steps[axis])
+        self._journal_state('move')
+        return success
+
+    @_transaction
+    def execute(self, program, index: int, wait: bool = False) -> bool:
+        """Send the pre-encoded move of a motionprogram.MotionProgram to
+        point index. If the carrier is not where the program expects it
+        (e.g. when resuming halfway), the move is computed afresh"""
+        expected = program.targets[index - 1] if index else program.origin
+        if self._steps == expected.tolist():
+            steps = program.moves(index)
+            if steps and not self._track_moves(
+                    steps, self._send(program.line(index))):
+                return False
+        else:
+            for axis in range(len(AXES)):
+                if self._steps[axis] is None:
+                    self.sync_position(axis)
+            if not self._step({axis: int(program.targets[index][axis]) -
+                               self._steps[axis]
+                               for axis in range(len(AXES))}):
+                return False
+        return self.wait_until_idle() if wait else True
+
+    @_transaction
+    def _send(self, data: bytes) -> bytes:
+        """Write a command line and return its replies"""
+        self._write(data)
+        return self._read()
+
+    def move_time(self, axis: int, steps: int) -> float:
+        """Predicted duration in seconds of a move of the given number of
+        steps, from the trapezoidal profile between begin and end velocity"""
+        begin = self.parameters["begin_velocity"][axis] or \
+            self.constants["Start_velocity"]
+        end = self.parameters["end_velocity"][axis] or \
+            self.parameters["velocity"]
+        return motion.duration(steps, begin, end,
+                               self.constants["acceleration"])
+
+    @_transaction
+    def wait_until_idle(self, axes=None, timeout: float = None) -> bool:
+        """Block until the moves of the given axes (default: all) finished.
+
+        Sleeps through most of the predicted move time, then polls the
+        positions with a growing delay until the targets are reached.
+        Returns False if that does not happen within timeout (default:
+        twice the predicted time plus the read timeout)"""
+        pending, finish, deadline, rest = self._idle_schedule(axes, timeout)
+        # A stop ends the wait early
+        if rest > 0 and self._interrupt.wait(rest):
+            return False
+        delay = self.constants["min_poll_delay"]
+        last = {}
+        while pending:
+            axes = list(pending)
+            replies = self.pipeline([self._query_line(axis, 'm')
+                                     for axis in axes])
+            for axis, reply in zip(axes, replies):
+                self._arrived(pending, axis,
+                              self._to_steps(reply,
+                                             self._query_line(axis, 'm')),
+                              last, finish)
+            if not pending:
+                break
+            if monotonic() + delay > deadline:
+                self._missed(pending)
+                return False
+            if self._interrupt.wait(delay):
+                return False
+            delay = min(2 * delay, self.constants["max_poll_delay"])
+        return True
+
+    def _idle_schedule(self, axes, timeout: float):
+        """Return the moves to wait for, their predicted end, the deadline
+        and how long to sleep before polling"""
+        pending = {axis: self._motion[axis]
+                   for axis in (range(len(AXES)) if axes is None else axes)
+                   if self._motion[axis] is not None}
+        if not pending:
+            return pending, 0.0, 0.0, 0.0
+        finish = max(start + duration
+                     for start, duration, _ in pending.values())
+        if timeout is None:
+            longest = max(duration for _, duration, _ in pending.values())
+            timeout = 2 * longest + self.constants["read_timeout"]
+        began = min(start for start, _, _ in pending.values())
+        rest = began + (finish - began) * self.constants["wait_fraction"] - \
+            monotonic()
+        return pending, finish, began + timeout, rest
+
+    def _arrived(self, pending: dict, axis: int, position: int, last: dict,
+                 finish: float):
+        """Drop an axis from pending once its polled position shows the
+        move has finished"""
+        target = pending[axis][2]
+        # Unknown target: done once the counter stopped changing
+        if position == target or (target is None and
+                                  last.get(axis) == position and
+                                  monotonic() >= finish):
+            del pending[axis]
+            self._motion[axis] = None
+            self._steps[axis] = position
+        last[axis] = position
+
+    def _missed(self, pending: dict):
+        """Forget the positions of axes that did not reach their targets"""
+        for axis in pending:
+            self._steps[axis] = None
+            self._motion[axis] = None
+        self.logger.warning("Axes %s did not reach their targets",
+                            ', '.join(AXES[axis] for axis in pending))
+        # A resume reads these counters back instead of trusting the
+        # journaled targets
+        self._journal_state('missed')
+
+    @_transaction
+    def fly_to_xyz(self, x: float = None, y: float = None, z: float = None,
+                   velocity: int = None, wait: bool = True,
+                   timeout: float = None):
+        """Move like move_to_xyz while a PositionSampler thread records
+        timestamped positions as fast as the link allows. velocity sets
+        the end velocity of the moving axes for this move only.
+
+        With wait, returns the finished sampler. Otherwise the sampler
+        runs on its own thread, holding the carrier until its join()
+        returned.
+        Returns None if a position is off limits"""
+        positions = (x, y, z)
+        moving = self._plan_move(positions)
+        if moving is None:
+            return None
+        # Resting axes are not polled, their tracked positions are used
+        for axis in range(len(AXES)):
+            if self._steps[axis] is None or \
+                    (axis in moving and self._needs_sync(axis)):
+                self.sync_position(axis)
+        restore = None
+        if velocity is not None:
+            restore = list(self.parameters["end_velocity"])
+            self._set_axis_parameter("end_velocity", "E",
+                                     [velocity if axis in moving else None
+                                      for axis in range(len(AXES))])
+        sampler = PositionSampler(self, moving, timeout, restore)
+        if not self._step(self._move_steps(positions, moving)):
+            sampler.reached = False
+            sampler.finish()
+            return sampler
+        if wait:
+            # Sample on this thread, which holds the carrier already
+            sampler.run()
+            if sampler.error is not None:
+                raise sampler.error
+        else:
+            sampler.start()
+        return sampler
+
+    @_transaction
+    def get_position(self, axis: int, refresh: bool = False) -> float:
+        """Gets position in cm. Only asks the motor controller if the
+        position is not tracked yet or refresh is requested. A refresh
+        during a move returns the live position but keeps the target"""
+        axis = int(axis)
+        if self._steps[axis] is None:
+            self.sync_position(axis)
+        elif refresh:
+            return self._live_position(axis, self._query_steps(axis))
+        return AXIS_SIGN[axis] * self._steps[axis] * \
+            self.constants["cm_per_step"]
+
+    def _live_position(self, axis: int, steps: int) -> float:
+        """Position in cm of a polled step counter. Adopts it as tracked
+        position unless the axis is still on its way to a target"""
+        motion = self._motion[axis]
+        if motion is None or steps == motion[2]:
+            self._motion[axis] = None
+            self._steps[axis] = steps
+            self._moves_since_sync[axis] = 0
+        return AXIS_SIGN[axis] * steps * self.constants["cm_per_step"]
+
+    @_transaction
+    def get_positions(self, refresh: bool = False) -> list:
+        """Positions of all axes in cm, see get_position. The axes that
+        have to be asked are queried in one pipelined batch"""
+        axes = [axis for axis in range(len(AXES))
+                if refresh or self._steps[axis] is None]
+        replies = self.pipeline([self._query_line(axis, 'm')
+                                 for axis in axes])
+        live = {axis: self._to_steps(reply, self._query_line(axis, 'm'))
+                for axis, reply in zip(axes, replies)}
+        for axis in axes:
+            if self._steps[axis] is None:
+                self._motion[axis] = None
+        return [self._live_position(axis, live[axis]) if axis in live
+                else self.get_position(axis) for axis in range(len(AXES))]
+
+    @_transaction
+    def sync_position(self, axis: int = None):
+        """Re-read the step counter of one or all axes from the controller"""
+        axes = range(len(AXES)) if axis is None else (axis,)
+        replies = self.pipeline([self._query_line(index, 'm')
+                                 for index in axes])
+        for index, reply in zip(axes, replies):
+            self._steps[index] = self._to_steps(
+                reply, self._query_line(index, 'm'))
+            self._moves_since_sync[index] = 0
+        self._journal_state('sync')
+
+    @_transaction
+    def _query_steps(self, axis: int) -> int:
+        """Live step counter of an axis"""
+        line = self._query_line(axis, 'm')
+        self._write(line)
+        return self._to_steps(self._read(), line)
+
+    @staticmethod
+    def _query_line(axis: int, opcode: str) -> bytes:
+        return bytes('{0}0{1}\r'.format(AXES[axis], opcode), 'utf-8')
+
+    def stop(self) -> float:
+        """Stop all axes. Safe to call from any thread: the command goes on
+        the wire right away, even while another thread is in the middle
+        of a command or wait. Running waits return False, calls waiting
+        for the carrier raise StoppedException. Returns the seconds from
+        the call until the stop command was written"""
+        called = perf_counter()
+        self._interrupt.set()
+        with self._wire_lock:
+            self._stops += 1
+        self._write(STOP_ALL)
+        self.stop_latency = perf_counter() - called
+        self.logger.info("Stop signal received. Motors stopped after %.2f ms",
+                         self.stop_latency * 1e3)
+        try:
+            # The reply is read once the interrupted thread let go
+            with self._lock:
+                self.logger.debug("Received: %s", self._read())
+                self._stopped()
+        finally:
+            self._interrupt.clear()
+        return self.stop_latency
+
+    def _zeroed(self):
+        # The current position is the new origin of all axes
+        self._steps = [0] * len(AXES)
+        self._moves_since_sync = [0] * len(AXES)
+        self._motion = [None] * len(AXES)
+
+    def _stopped(self):
+        # Moves were cut short, positions have to be read back
+        self._steps = [None] * len(AXES)
+        self._motion = [None] * len(AXES)
+        self._journal_state('stop')
+
+    def _read(self, timeout: float = None) -> bytes:
+        """Return the replies to the oldest unread command line of the
+        calling thread.
+
+        Every addressed command of a line is answered with its own
+        '\\r'-terminated reply, in the order the lines were written.
+        Replies to lines of another thread (a stop) are kept for it.
+        Replies that do not echo the address and opcode of their command
+        are stale (answers to a command that timed out) and dropped.
+        Returns as soon as all replies arrived, raises
+        ResponseTimeoutException once the deadline has passed, discarding
+        all input so far."""
+        if timeout is None:
+            timeout = self.constants["read_timeout"]
+        owner = threading.get_ident()
+        with self._wire_lock:
+            target = next((entry for entry in self._in_flight
+                           if entry[3] == owner), None)
+            if target is None:
+                # Nothing sent: take the next reply that nobody waits for
+                target = [None, 1, None, owner, None]
+                self._in_flight.append(target)
+        deadline = monotonic() + timeout
+        buffer = self._rx_buffer
+        connection = self.serial_connection
+        while target[4] is None:
+            with self._wire_lock:
+                head = next(entry for entry in self._in_flight
+                            if entry[4] is None)
+            data, expected, sent = head[:3]
+            echoes = [] if data is None else reply_echoes(data)
+            found = 0
+            end = 0
+            while found < expected:
+                index = buffer.find(TERMINATOR, end)
+                if index >= 0:
+                    if found < len(echoes) and \
+                            not answers(buffer[end:index], echoes[found]):
+                        self.logger.warning("Dropping stale reply %s to %s",
+                                            bytes(buffer[end:index + 1]),
+                                            data)
+                        del buffer[end:index + 1]
+                        continue
+                    found += 1
+                    end = index + 1
+                    continue
+                if monotonic() > deadline:
+                    if sent is not None and self.stats is not None:
+                        self.stats.record(data, len(buffer))
+                    # Later replies can no longer be matched to commands,
+                    # and a late one must not answer the next command
+                    received = bytes(buffer)
+                    buffer.clear()
+                    connection.reset_input_buffer()
+                    with self._wire_lock:
+                        self._in_flight.clear()
+                    raise ResponseTimeoutException(
+                        {'received': received, 'expected': expected,
+                         'timeout': timeout},
+                        'No complete reply from the motion controller')
+                # Block for the first byte, then take whatever else waits
+                buffer += connection.read(max(1, connection.in_waiting))
+            head[4] = bytes(buffer[:end])
+            del buffer[:end]
+            if sent is not None and self.stats is not None:
+                self.stats.record(data, len(head[4]), perf_counter() - sent)
+        with self._wire_lock:
+            self._in_flight.remove(target)
+        return target[4]
 
     def _write(self, data):
-        self.serial_connection.write(data)
+        with self._wire_lock:
+            self._in_flight.append([data, max(expected_replies(data), 1),
+                                    None if self.stats is None
+                                    else perf_counter(),
+                                    threading.get_ident(), None])
+            self.serial_connection.write(data)
+
+    @_transaction
+    def pipeline(self, lines, window: int = None) -> list:
+        """Send command lines keeping up to window of them in flight and
+        return their replies in the same order. A rejected command is
+        logged together with the line that caused it"""
+        if window is None:
+            window = self.constants["pipeline_window"]
+        lines = list(lines)
+        replies = []
+        for sent, line in enumerate(lines):
+            if sent - len(replies) >= window:
+                replies.append(self._read())
+            self._write(line)
+        while len(replies) < len(lines):
+            replies.append(self._read())
+        for line, reply in zip(lines, replies):
+            if ERROR in reply:
+                self.logger.warning("Command %s rejected: %s", line, reply)
+        return replies
+
+    def instrument(self, stats: CommandStats = None) -> CommandStats:
+        """Record traffic and round-trip latency of every command into
+        stats (a new CommandStats by default) and return it. Setting
+        the stats attribute to None turns recording off again"""
+        self.stats = CommandStats() if stats is None else stats
+        return self.stats
+
+    def _flush(self):
+        """Discard everything received but not read yet"""
+        self._rx_buffer.clear()
+        with self._wire_lock:
+            self._in_flight.clear()
+        self.serial_connection.reset_input_buffer()
 
     def _set_velocities(self, x_end, y_end, z_end, x_begin, y_begin, z_begin):
         # Set Start velocity (13,000 is fastest possible)
         self.logger.debug("Setting beginning velocity")
-        self._write(bytes('X0B{0},Y0B{1},Z0B{2}\r'.format(x_begin,
-                                                          y_begin,
-                                                          z_begin),
-                          'utf-8'))
-        self.logger.debug("Received: " + str(self._read()))
+        self._set_axis_parameter("begin_velocity", "B",
+                                 (x_begin, y_begin, z_begin))
 
         # Set End Velocity [Full Step: 1 (slowest) to 20,000 (fastest)]
         self.logger.debug("Setting end velocity")
-        self._write(bytes('X0E{0},Y0E{1},Z0E{2}\r'.format(x_end, y_end, z_end),
-                          'utf-8'))
-        self.logger.debug("Received: " + str(self._read()))
+        self._set_axis_parameter("end_velocity", "E", (x_end, y_end, z_end))
+
+    @_transaction
+    def _set_axis_parameter(self, parameter: str, opcode: str, values,
+                            force: bool = False) -> bool:
+        """Send one setting per axis (None leaves the axis alone) in one
+        command line. Values the controller already acknowledged are not
+        sent again unless forced. Returns success"""
+        changes = self._setting_changes(parameter, values, force)
+        if not changes:
+            return changes is not None
+        self._write(self._setting_line(opcode, changes))
+        try:
+            received = self._read()
+        except ResponseTimeoutException:
+            self._forget_settings(parameter, changes)
+            raise
+        return self._track_settings(parameter, changes, received)
+
+    def _setting_changes(self, parameter: str, values,
+                         force: bool = False) -> dict:
+        """Values per axis that differ from the acknowledged ones, None if
+        any of them is not a valid setting"""
+        cache = self.parameters[parameter]
+        changes = {}
+        for axis, value in enumerate(values):
+            if value is None:
+                continue
+            if not str(value).isdigit():
+                self.logger.warning("Ignoring %s %r of %s axis", parameter,
+                                    value, AXES[axis])
+                return None
+            if force or cache[axis] != int(value):
+                changes[axis] = int(value)
+        return changes
+
+    @staticmethod
+    def _setting_line(opcode: str, changes: dict) -> bytes:
+        return bytes(','.join('{0}0{1}{2}'.format(AXES[axis], opcode, value)
+                              for axis, value in changes.items()) + '\r',
+                     'utf-8')
+
+    def _forget_settings(self, parameter: str, changes: dict):
+        for axis in changes:
+            self.parameters[parameter][axis] = None
+
+    def _track_settings(self, parameter: str, changes: dict,
+                        received: bytes) -> bool:
+        """Update the settings cache from the replies to a setting line"""
+        cache = self.parameters[parameter]
+        self.logger.debug("Received: %s", received)
+        replies = self._split_replies(received)
+        success = True
+        for axis, value in changes.items():
+            if ERROR in replies.get(axis, ERROR):
+                self.logger.warning("%s axis rejected %s %s", AXES[axis],
+                                    parameter, value)
+                cache[axis] = None
+                success = False
+            else:
+                cache[axis] = value
+        self._journal_state('setting')
+        return success
+
+    def _get_axis_parameter(self, parameter: str, opcode: str, axis: int,
+                            refresh: bool = False):
+        """Return a setting of an axis, from the cache unless it is unknown
+        or refresh is requested"""
+        return self._get_axis_parameters(parameter, opcode, refresh,
+                                         (axis,))[axis]
+
+    @_transaction
+    def _get_axis_parameters(self, parameter: str, opcode: str,
+                             refresh: bool = False, axes=None) -> list:
+        """Return a setting of all axes. Unknown ones, or all on refresh,
+        are queried in one pipelined batch"""
+        cache = self.parameters[parameter]
+        axes = [axis for axis in (range(len(AXES)) if axes is None else axes)
+                if refresh or cache[axis] is None]
+        replies = self.pipeline([self._query_line(axis, opcode)
+                                 for axis in axes])
+        for axis, reply in zip(axes, replies):
+            cache[axis] = None if ERROR in reply else self._to_steps(
+                reply, self._query_line(axis, opcode))
+        return list(cache)
 
     # handy functions
     def _to_cm(self, response) -> float:
         return float(response[3:-1].decode()) * self.constants["cm_per_step"]
 
+    @staticmethod
+    def _to_steps(response, line: bytes = None) -> int:
+        """Value of a query reply. With the query line, a reply that does
+        not echo its address and opcode raises ReplyMismatchException"""
+        if line is not None and response[:3] != line[:3]:
+            raise ReplyMismatchException(
+                {'command': line, 'reply': response},
+                'Reply does not belong to the command')
+        return int(response[3:-1].decode())
+
+    @staticmethod
+    def _split_replies(received: bytes) -> dict:
+        """Map axis index to its reply in a multi-axis response"""
+        return {AXES.index(reply[:1].decode()): reply
+                for reply in received.split(TERMINATOR)
+                if reply[:1].decode() in AXES}
+
     def _print_range(self):
         self.logger.info("The possible range of movement is:")
         self.logger.info(
@@ -288,8 +1030,18 @@ class Carrier(Periphery):
                 return False
         else:
             return True
+
+    def limits(self) -> tuple:
+        """Return the (min, max) software limits in cm of every axis"""
+        return ((self.constants["Min_position"],
+                 self.constants["Max_position"]),
+                (self.constants["Min_y_position"],
+                 self.constants["Max_y_position"]),
+                (self.constants["Min_Z_position"],
+                 self.constants["Max_Z_position"]))
     
     # Return current speed of the motor
+    @_transaction
     def get_velocity(self, axis: int):
         if axis == 0:
             self._write(b'X' + b'0v\r')
@@ -305,59 +1057,103 @@ class Carrier(Periphery):
             return speed * self.constants["steps_per_cm"]
 
     # Set begin velocity
-    def _set_begin_velocity(self, axis: int, velocity: int):
-        if axis == 0:
-            self._write(bytes('X0B{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 1:
-            self._write(bytes('Y0B{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 2:
-            self._write(bytes('Z0B{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-    
+    def _set_begin_velocity(self, axis: int, velocity: int) -> bool:
+        values = [None] * len(AXES)
+        values[axis] = velocity
+        return self._set_axis_parameter("begin_velocity", "B", values)
+
     # Set end velocity
-    def _set_end_velocity(self, axis: int, velocity: int):
-        if axis == 0:
-            self._write(bytes('X0E{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 1:
-            self._write(bytes('Y0E{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-        if axis == 2:
-            self._write(bytes('Z0E{0}\r'.format(velocity), 'utf-8'))
-            self.logger.debug("Received: " + str(self._read()))
-    
+    def _set_end_velocity(self, axis: int, velocity: int) -> bool:
+        values = [None] * len(AXES)
+        values[axis] = velocity
+        return self._set_axis_parameter("end_velocity", "E", values)
+
     # Get begin velocity
-    def get_begin_velocity(self, axis: int):
-        if axis == 0:
-            self._write(b'X0b\r')
-            # covert last 4 bytes to float
-            speed = self._read()[3:-1]
-            return speed
-        if axis == 1:
-            self._write(b'Y0b\r')
-            speed = self._read()[3:-1]
-            return speed
-        if axis == 2:
-            self._write(b'Z0b\r')
-            speed = self._read()[3:-1]
-            return speed
-        
+    def get_begin_velocity(self, axis: int, refresh: bool = False) -> int:
+        return self._get_axis_parameter("begin_velocity", "b", axis, refresh)
+
     # Get end velocity
-    def get_end_velocity(self, axis: int):
-        if axis == 0:
-            self._write(b'X0e\r')
-            # covert last 4 bytes to float
-            speed = self._read()[3:-1]
-            return speed
-        if axis == 1:
-            self._write(b'Y0e\r')
-            speed = self._read()[3:-1]
-            return speed
-        if axis == 2:
-            self._write(b'Z0e\r')
-            speed = self._read()[3:-1]
-            return speed
+    def get_end_velocity(self, axis: int, refresh: bool = False) -> int:
+        return self._get_axis_parameter("end_velocity", "e", axis, refresh)
+
+    # Get begin and end velocity of all axes
+    def get_begin_velocities(self, refresh: bool = False) -> list:
+        return self._get_axis_parameters("begin_velocity", "b", refresh)
+
+    def get_end_velocities(self, refresh: bool = False) -> list:
+        return self._get_axis_parameters("end_velocity", "e", refresh)
+
+
+class PositionSampler(threading.Thread):
+    """Polls the step counters of the moving axes during a fly move.
+
+    Every sample is (t, x, y, z): monotonic seconds at the middle of the
+    round trip of the position queries, positions in cm. samples is a
+    flat array('d'), e.g. numpy.frombuffer(sampler.samples).reshape(-1, 4)"""
+
+    def __init__(self, carrier: Carrier, axes, timeout: float = None,
+                 restore=None):
+        super().__init__(name='PositionSampler', daemon=True)
+        self.carrier = carrier
+        self.axes = list(axes)
+        self.timeout = timeout
+        # End velocities to set again once the move is over
+        self._restore = restore
+        self.samples = array('d')
+        # Whether all axes reached their targets, None while running
+        self.reached = None
+        self.error = None
+
+    def __len__(self):
+        return len(self.samples) // (len(AXES) + 1)
+
+    def run(self):
+        with self.carrier._lock:
+            self._sample()
+
+    def _sample(self):
+        carrier = self.carrier
+        cm_per_step = carrier.constants["cm_per_step"]
+        try:
+            pending, finish, deadline, _ = carrier._idle_schedule(
+                self.axes, self.timeout)
+            position = [AXIS_SIGN[axis] * steps * cm_per_step
+                        for axis, steps in enumerate(carrier._steps)]
+            last = {}
+            # A stop ends the sampling
+            while pending and not carrier._interrupt.is_set():
+                axes = list(pending)
+                sent = monotonic()
+                replies = carrier.pipeline([carrier._query_line(axis, 'm')
+                                            for axis in axes])
+                received = monotonic()
+                for axis, reply in zip(axes, replies):
+                    steps = carrier._to_steps(
+                        reply, carrier._query_line(axis, 'm'))
+                    position[axis] = AXIS_SIGN[axis] * steps * cm_per_step
+                    carrier._arrived(pending, axis, steps, last, finish)
+                self.samples.append((sent + received) / 2)
+                self.samples.extend(position)
+                if pending and received > deadline:
+                    carrier._missed(pending)
+                    break
+            self.reached = not pending
+        except Exception as error:
+            self.error = error
+            self.reached = False
+        try:
+            self.finish()
+        except Exception as error:
+            self.error = self.error or error
+
+    def finish(self):
+        """Restore the end velocities changed for the fly move"""
+        if self._restore is not None:
+            restore, self._restore = self._restore, None
+            self.carrier._set_axis_parameter("end_velocity", "E", restore)
 
- 
\ No newline at end of file
+    def join(self, timeout: float = None):
+        """Wait for the move to end. Raises what stopped the sampler"""
+        super().join(timeout)
+        if self.error is not None and not self.is_alive():
+            raise self.error
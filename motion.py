@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Trapezoidal velocity profile of a SimpleStep axis.
+
+A move starts at the begin velocity (B), ramps up with a constant
+acceleration to the end velocity (E), cruises and ramps down again.
+Short moves never reach E and follow a triangular profile instead.
+All quantities are in steps, seconds and steps per second.
+"""
+
+from math import sqrt
+
+
+def profile(steps: int, begin: float, end: float, acceleration: float):
+    """Return (peak velocity, ramp time, cruise time) of a move"""
+    distance = abs(steps)
+    begin = max(float(begin), 1.0)
+    end = max(float(end), begin)
+    if distance == 0:
+        return begin, 0.0, 0.0
+    if acceleration <= 0 or end == begin:
+        return end, 0.0, distance / end
+    ramp_distance = (end * end - begin * begin) / (2 * acceleration)
+    if 2 * ramp_distance <= distance:
+        return (end, (end - begin) / acceleration,
+                (distance - 2 * ramp_distance) / end)
+    # Triangular profile: decelerate before reaching the end velocity
+    peak = sqrt(begin * begin + acceleration * distance)
+    return peak, (peak - begin) / acceleration, 0.0
+
+
+def duration(steps: int, begin: float, end: float,
+             acceleration: float) -> float:
+    """Time in seconds a move of the given number of steps takes"""
+    _, ramp, cruise = profile(steps, begin, end, acceleration)
+    return 2 * ramp + cruise
+
+
+def travelled(elapsed: float, steps: int, begin: float, end: float,
+              acceleration: float) -> float:
+    """Unsigned number of steps covered after elapsed seconds"""
+    distance = abs(steps)
+    peak, ramp, cruise = profile(steps, begin, end, acceleration)
+    total = 2 * ramp + cruise
+    if elapsed <= 0:
+        return 0.0
+    if elapsed >= total:
+        return float(distance)
+    start = max(float(begin), 1.0)
+    if acceleration <= 0:
+        return peak * elapsed
+    ramp_distance = start * ramp + acceleration * ramp * ramp / 2
+    if elapsed < ramp:
+        return start * elapsed + acceleration * elapsed * elapsed / 2
+    if elapsed < ramp + cruise:
+        return ramp_distance + peak * (elapsed - ramp)
+    left = total - elapsed
+    return distance - (start * left + acceleration * left * left / 2)
+
+
+def velocity(elapsed: float, steps: int, begin: float, end: float,
+             acceleration: float) -> float:
+    """Unsigned velocity after elapsed seconds, 0 outside of the move"""
+    peak, ramp, cruise = profile(steps, begin, end, acceleration)
+    total = 2 * ramp + cruise
+    if elapsed < 0 or elapsed >= total or steps == 0:
+        return 0.0
+    start = max(float(begin), 1.0)
+    if elapsed < ramp:
+        return start + acceleration * elapsed
+    if elapsed < ramp + cruise:
+        return peak
+    return start + acceleration * (total - elapsed)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Compile-once motion programs for whole scans.
+
+A MotionProgram takes all target points of a scan at once, checks them
+against the software limits in one vectorized pass (reporting every
+offending point before anything moves) and pre-encodes the relative
+move of every point into one contiguous command buffer. The same sign
+conventions as Carrier.move_to apply: the X and Y step counters run
+against the cm axes, Z runs with it.
+
+    program = MotionProgram.for_carrier(carrier, points)
+    for index in range(len(program)):
+        carrier.execute(program, index, wait=True)
+    program.dump('scan.cmd')
+"""
+
+import numpy as np
+
+from linact import AXES, AXIS_SIGN
+from periphery import OutOfLimitException
+
+
+class MotionProgram:
+    """Validated, pre-encoded relative moves to a list of points"""
+
+    def __init__(self, points, limits, steps_per_cm: float,
+                 origin=(0, 0, 0)):
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+        if self.points.shape[1] != len(AXES):
+            raise ValueError("Points need one coordinate per axis")
+        self.check_limits(np.asarray(limits, dtype=float))
+        # Step counter at the start, at every point and the moves between
+        self.origin = np.asarray(origin, dtype=np.int64)
+        self.targets = (np.rint(self.points * steps_per_cm) *
+                        AXIS_SIGN).astype(np.int64)
+        self.deltas = np.diff(np.vstack((self.origin, self.targets)), axis=0)
+        self.buffer, self.offsets = self._encode(self.deltas)
+
+    @classmethod
+    def for_carrier(cls, carrier, points):
+        """Program for a carrier, starting from its current position"""
+        carrier.sync_position()
+        return cls(points, carrier.limits(),
+                   carrier.constants["steps_per_cm"], carrier._steps)
+
+    def __len__(self):
+        return len(self.points)
+
+    def check_limits(self, limits: np.ndarray):
+        """Raise OutOfLimitException listing every point off limits"""
+        outside = (self.points < limits[:, 0]) | (self.points > limits[:, 1])
+        offending = np.flatnonzero(outside.any(axis=1))
+        if len(offending):
+            raise OutOfLimitException(
+                {'indices': offending.tolist(),
+                 'axes': [''.join(np.array(AXES)[outside[index]])
+                          for index in offending],
+                 'limits': limits.tolist()},
+                '{0} points are off limits'.format(len(offending)))
+
+    @staticmethod
+    def _encode(deltas: np.ndarray):
+        """One command line per point in a single buffer, and the offset of
+        every line in it. Points without movement get an empty line"""
+        parts = np.char.add(np.array([axis + '0RNY' for axis in AXES]),
+                            np.char.mod('%+d', deltas))
+        parts = np.where(deltas != 0, parts, '')
+        lines = [','.join(part for part in row if part)
+                 for row in parts.tolist()]
+        lines = [line + '\r' if line else '' for line in lines]
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in lines], out=offsets[1:])
+        return ''.join(lines).encode('ascii'), offsets
+
+    def line(self, index: int) -> bytes:
+        """Command line moving from the previous point to point index"""
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+
+    def moves(self, index: int) -> dict:
+        """Steps per axis index of the move to point index"""
+        return {axis: int(count)
+                for axis, count in enumerate(self.deltas[index]) if count}
+
+    def dump(self, path: str):
+        """Write the whole command stream to a file"""
+        with open(path, 'wb') as file:
+            file.write(self.buffer)
@@ -27,6 +27,25 @@ class OutOfLimitException(PeripheryException):
         self.message = message
 
 
+class ResponseTimeoutException(PeripheryException):
+    """Exception raised when a device does not answer before its deadline"""
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+class ReplyMismatchException(PeripheryException):
+    """Exception raised when a reply does not belong to its command"""
+    def __init__(self, expression, message):
+        self.expression = expression
+        self.message = message
+
+
+class StoppedException(PeripheryException):
+    """Exception raised for a command cancelled by a stop"""
+    pass
+
+
 class Periphery:
     def __init__(self, name: str, parameters: Dict, constants=None):
         self.parameters = parameters
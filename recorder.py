@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Crash-safe measurement log of a scan.
+
+A ScanRecorder preallocates one fixed-width record per scan point in a
+memory-mapped .npy file: point index, step counters of the carrier,
+wall-clock timestamp, the measured channels and a completion flag that
+is set last. Pages are flushed to disk periodically, so memory use stays
+flat and a crash loses at most the last flush interval. Opening an
+existing file resumes it: Scan.run skips the points already complete.
+
+    recorder = ScanRecorder('map.npy', len(scan.points), channels=3)
+    scan.run(measure, recorder=recorder)
+    recorder.close()
+    data = ScanRecorder.load('map.npy')
+"""
+
+import logging
+import os
+from time import monotonic, time
+
+import numpy as np
+
+from linact import AXES
+
+
+def record_dtype(channels: int) -> np.dtype:
+    """Layout of one record with the given number of measurement channels"""
+    return np.dtype([('index', '<i8'),
+                     ('steps', '<i8', (len(AXES),)),
+                     ('time', '<f8'),
+                     ('values', '<f8', (channels,)),
+                     ('done', 'u1')])
+
+
+class ScanRecorder:
+    """Fixed-width records of a scan in a memory-mapped file"""
+
+    def __init__(self, path: str, points: int, channels: int = 1,
+                 flush_interval: float = 5.0):
+        self.logger = logging.getLogger('MainLogger.ScanRecorder')
+        self.path = path
+        self.flush_interval = flush_interval
+        dtype = record_dtype(channels)
+        if os.path.exists(path):
+            self.records = np.load(path, mmap_mode='r+')
+            if self.records.dtype != dtype or \
+                    self.records.shape != (points,):
+                raise ValueError(
+                    "{0} holds {1} records of another layout".format(
+                        path, len(self.records)))
+            self.logger.info("Resuming %s, %d of %d points complete", path,
+                             self.completed(), points)
+        else:
+            self.records = np.lib.format.open_memmap(path, mode='w+',
+                                                     dtype=dtype,
+                                                     shape=(points,))
+            self.records['index'] = -1
+            self.records.flush()
+        self._flushed = monotonic()
+
+    @staticmethod
+    def load(path: str) -> np.ndarray:
+        """Read-only view of the complete records of a file"""
+        records = np.load(path, mmap_mode='r')
+        return records[records['done'] == 1]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_done(self, index: int) -> bool:
+        return bool(self.records['done'][index])
+
+    def completed(self) -> int:
+        """Number of complete records"""
+        return int(np.count_nonzero(self.records['done']))
+
+    def record(self, index: int, steps, values):
+        """Store the measurement of point index, taken at the given step
+        counters. values is a number or one per channel"""
+        record = self.records[index]
+        record['index'] = index
+        record['steps'] = [-1 if count is None else count for count in steps]
+        record['time'] = time()
+        record['values'] = values
+        # Set last: a record cut short by a crash stays incomplete
+        record['done'] = 1
+        if monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.records.flush()
+        self._flushed = monotonic()
+
+    def close(self):
+        if self.records is not None:
+            self.flush()
+            self.records = None
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Visiting order for arbitrary measurement points.
+
+The travel time between two points is the longest of the per-axis move
+times, since the axes of a combined move run independently at their own
+begin/end velocities (see motion.py). optimize_route builds a nearest
+neighbour path and improves it with 2-opt moves restricted to each
+point's nearest neighbours. Neighbours are found with a uniform grid in
+a time-scaled space (cm divided by the cruise speed of each axis), so
+tens of thousands of points stay tractable.
+
+    model = TravelModel.for_carrier(carrier)
+    route = optimize_route(points, model, start=carrier.get_positions())
+    print(route.naive_time, route.time)
+    Scan(carrier, route.points).run(measure)
+"""
+
+import itertools
+from collections import namedtuple
+from heapq import heappush, heappushpop
+from math import sqrt
+
+import numpy as np
+
+from linact import AXES
+
+# Reordered points, their indices in the input, predicted seconds of
+# travel in that order and in input order
+Route = namedtuple('Route', ['points', 'order', 'time', 'naive_time'])
+
+
+class TravelModel:
+    """Move time between points in cm, per-axis trapezoidal profiles"""
+
+    def __init__(self, begin_velocity, end_velocity, acceleration: float,
+                 steps_per_cm: float):
+        self.steps_per_cm = float(steps_per_cm)
+        self.acceleration = float(acceleration)
+        self.begin = np.maximum(np.asarray(begin_velocity, dtype=float), 1.0)
+        self.end = np.maximum(np.asarray(end_velocity, dtype=float),
+                              self.begin)
+        # Steps spent ramping up and down, and the time that takes
+        self.ramp = (self.end ** 2 - self.begin ** 2) / self.acceleration
+        self.ramp_time = 2 * (self.end - self.begin) / self.acceleration
+
+    @classmethod
+    def for_carrier(cls, carrier):
+        """Model using a carrier's acknowledged velocities"""
+        begin = [velocity or carrier.constants["Start_velocity"]
+                 for velocity in carrier.parameters["begin_velocity"]]
+        end = [velocity or carrier.parameters["velocity"]
+               for velocity in carrier.parameters["end_velocity"]]
+        return cls(begin, end, carrier.constants["acceleration"],
+                   carrier.constants["steps_per_cm"])
+
+    def times(self, origin, target) -> np.ndarray:
+        """Seconds to move between (..., 3) arrays of points"""
+        steps = np.rint(np.abs(np.asarray(target, dtype=float) -
+                               np.asarray(origin, dtype=float)) *
+                        self.steps_per_cm)
+        peak = np.sqrt(self.begin ** 2 + self.acceleration * steps)
+        axis_times = np.where(
+            steps >= self.ramp,
+            self.ramp_time + (steps - self.ramp) / self.end,
+            2 * (peak - self.begin) / self.acceleration)
+        return np.where(steps > 0, axis_times, 0.0).max(axis=-1)
+
+    def path_time(self, points, start=None) -> float:
+        """Seconds to visit the points in order, from start if given"""
+        points = np.asarray(points, dtype=float)
+        if start is not None:
+            points = np.vstack((start, points))
+        return float(self.times(points[:-1], points[1:]).sum())
+
+    def _scalar(self):
+        """Pure Python move time for the inner loops of the optimizer"""
+        axes = list(zip(self.begin.tolist(), self.end.tolist(),
+                        self.ramp.tolist(), self.ramp_time.tolist()))
+        acceleration = self.acceleration
+
+        def time(origin, target):
+            longest = 0.0
+            for a, b, (begin, end, ramp, ramp_time) in zip(origin, target,
+                                                           axes):
+                steps = abs(a - b)
+                if steps == 0:
+                    continue
+                if steps >= ramp:
+                    axis_time = ramp_time + (steps - ramp) / end
+                else:
+                    axis_time = 2 * (sqrt(begin * begin +
+                                          acceleration * steps) - begin) \
+                        / acceleration
+                if axis_time > longest:
+                    longest = axis_time
+            return longest
+        return time
+
+
+class _Grid:
+    """Uniform grid over points for Chebyshev nearest neighbour queries"""
+
+    def __init__(self, coordinates: np.ndarray):
+        self.coordinates = coordinates.tolist()
+        low = coordinates.min(axis=0)
+        extent = coordinates.max(axis=0) - low
+        spread = extent[extent > 0]
+        # About two points per occupied cell
+        self.cell = float(np.prod(spread) * 2 / len(coordinates)) \
+            ** (1 / len(spread)) if len(spread) else 1.0
+        self.low = low
+        keys = np.floor((coordinates - low) / self.cell).astype(np.int64)
+        self.last_ring = int(np.abs(keys).max()) if len(keys) else 0
+        self.cells = {}
+        for index, key in enumerate(map(tuple, keys.tolist())):
+            self.cells.setdefault(key, set()).add(index)
+        self.keys = keys
+        self._rings = {}
+
+    def _ring(self, radius: int):
+        ring = self._rings.get(radius)
+        if ring is None:
+            ring = [offset for offset in itertools.product(
+                range(-radius, radius + 1), repeat=self.keys.shape[1])
+                if max(map(abs, offset)) == radius]
+            self._rings[radius] = ring
+        return ring
+
+    def remove(self, index: int):
+        self.cells[tuple(self.keys[index].tolist())].discard(index)
+
+    def nearest(self, point, count: int = 1, skip: int = None) -> list:
+        """Indices of the count nearest points still in the grid"""
+        key = np.floor((np.asarray(point, dtype=float) - self.low) /
+                       self.cell).astype(np.int64)
+        key = tuple(key.tolist())
+        point = tuple(point)
+        coordinates = self.coordinates
+        best = []
+        radius = 0
+        # Rings beyond the grid and the point's own offset hold nothing
+        last = self.last_ring + max(map(abs, key)) + 1
+        while radius <= last:
+            for offset in self._ring(radius):
+                cell = self.cells.get(tuple(k + o for k, o in
+                                            zip(key, offset)))
+                if not cell:
+                    continue
+                for index in cell:
+                    if index == skip:
+                        continue
+                    distance = max(abs(a - b) for a, b in
+                                   zip(coordinates[index], point))
+                    if len(best) < count:
+                        heappush(best, (-distance, index))
+                    elif -best[0][0] > distance:
+                        heappushpop(best, (-distance, index))
+            # Points outside this ring are at least radius cells away
+            if len(best) == count and -best[0][0] <= radius * self.cell:
+                break
+            radius += 1
+        return [index for _, index in sorted(best, reverse=True)]
+
+
+def nearest_neighbour_order(coordinates: np.ndarray, start) -> np.ndarray:
+    """Greedy path from start, always to the closest unvisited point"""
+    grid = _Grid(coordinates)
+    order = np.empty(len(coordinates), dtype=np.int64)
+    current = start
+    for step in range(len(coordinates)):
+        index = grid.nearest(current)[0]
+        grid.remove(index)
+        order[step] = index
+        current = coordinates[index]
+    return order
+
+
+def two_opt(order: np.ndarray, steps: list, neighbours: list, time,
+            max_passes: int = 10) -> np.ndarray:
+    """Improve an open path whose first node stays fixed by reversing
+    segments, considering only edges to each node's neighbours. The
+    neighbours of a node are (node, time) pairs"""
+    tour = np.array(order, dtype=np.int64)
+    size = len(tour)
+    position = np.empty(size, dtype=np.int64)
+    position[tour] = np.arange(size)
+
+    def cost(a, b):
+        return 0.0 if a is None or b is None else time(steps[a], steps[b])
+
+    def node(index):
+        return int(tour[index]) if 0 <= index < size else None
+
+    def reverse(first, last):
+        tour[first:last + 1] = tour[first:last + 1][::-1].copy()
+        position[tour[first:last + 1]] = np.arange(first, last + 1)
+
+    for _ in range(max_passes):
+        improved = False
+        for a in range(size):
+            for c, to_c in neighbours[a]:
+                i, j = int(position[a]), int(position[c])
+                if j > i + 1:
+                    # Edges (a, b) and (c, d) become (a, c) and (b, d)
+                    b, d = node(i + 1), node(j + 1)
+                    gain = cost(a, b) + cost(c, d) - to_c - cost(b, d)
+                    if gain > 1e-9:
+                        reverse(i + 1, j)
+                        improved = True
+                elif 1 <= j < i - 1:
+                    # Edges (p, c) and (q, a) become (p, q) and (c, a)
+                    p, q = node(j - 1), node(i - 1)
+                    gain = cost(p, c) + cost(q, a) - cost(p, q) - to_c
+                    if gain > 1e-9:
+                        reverse(j, i - 1)
+                        improved = True
+        if not improved:
+            break
+    return tour
+
+
+def optimize_route(points, model: TravelModel, start=None,
+                   neighbours: int = 8, max_passes: int = 10) -> Route:
+    """Reorder points to shorten the total travel time from start (by
+    default the first point). Returns a Route with the new order and the
+    predicted travel time before and after"""
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    if points.shape[1] != len(AXES):
+        raise ValueError("Points need one coordinate per axis")
+    naive_time = model.path_time(points, start)
+    if len(points) < 3:
+        return Route(points, np.arange(len(points)), naive_time, naive_time)
+
+    # Node 0 is the fixed start of the path
+    nodes = np.vstack((points[:1] if start is None
+                       else np.asarray(start, dtype=float).reshape(1, -1),
+                       points))
+    speed = model.end / model.steps_per_cm
+    scaled = nodes / speed
+    order = nearest_neighbour_order(scaled[1:], scaled[0]) + 1
+    grid = _Grid(scaled)
+    nearest = np.array([grid.nearest(scaled[index], neighbours, skip=index)
+                        for index in range(len(nodes))])
+    times = model.times(nodes[:, None], nodes[nearest])
+    neighbour_lists = [list(zip(row, row_times)) for row, row_times
+                       in zip(nearest.tolist(), times.tolist())]
+    steps = [tuple(row) for row in
+             np.rint(nodes * model.steps_per_cm).tolist()]
+    tour = two_opt(np.concatenate(([0], order)), steps, neighbour_lists,
+                   model._scalar(), max_passes)
+    order = tour[1:] - 1
+    if start is None:
+        # The first point was visited twice: as start and in the tour
+        order = order[order != 0]
+        order = np.concatenate(([0], order))
+    reordered = points[order]
+    return Route(reordered, order, model.path_time(reordered, start),
+                 naive_time)
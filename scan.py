@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Raster scans for field mapping on top of linact.Carrier.
+
+A Scan holds an (N, 3) array of target points in cm. Regular grids are
+built by Scan.grid in serpentine (boustrophedon) order: the fastest axis
+reverses direction on every row and the rows reverse on every plane, so
+the gantry never flies back across the map.
+
+    scan = Scan.grid(carrier, x=(0, 10), y=(-5, 5), pitch=0.5)
+    values = scan.run(measure=lambda index, point: probe.read())
+
+Scan.fly sweeps every row in one continuous move instead and returns
+timestamped positions to interpolate the instrument's readings against.
+"""
+
+import logging
+from collections import namedtuple
+from time import monotonic
+
+import numpy as np
+
+from linact import AXES
+from motionprogram import MotionProgram
+from periphery import PeripheryException, StoppedException
+
+# done/total points, elapsed and estimated remaining seconds, points/s
+ScanProgress = namedtuple('ScanProgress',
+                          ['done', 'total', 'elapsed', 'eta', 'rate'])
+
+
+def axis_values(limits: tuple, pitch: float) -> np.ndarray:
+    """Points from start to stop (inclusive) of an axis at the given pitch"""
+    start, stop = limits
+    count = int(np.floor(abs(stop - start) / pitch + 1e-9)) + 1
+    return start + np.sign(stop - start) * pitch * np.arange(count)
+
+
+def serpentine(xs, ys, zs) -> np.ndarray:
+    """Return the (N, 3) grid of the given axis values in serpentine order"""
+    nx, ny, nz = len(xs), len(ys), len(zs)
+    iz, iy, ix = np.indices((nz, ny, nx)).reshape(3, -1)
+    # Every other row (counted across planes) runs backwards in x,
+    # every other plane runs backwards in y
+    ix = np.where((iz * ny + iy) % 2 == 1, nx - 1 - ix, ix)
+    iy = np.where(iz % 2 == 1, ny - 1 - iy, iy)
+    return np.column_stack((np.asarray(xs, float)[ix],
+                            np.asarray(ys, float)[iy],
+                            np.asarray(zs, float)[iz]))
+
+
+class Scan:
+    """Visits a list of points with a carrier and measures at each"""
+
+    def __init__(self, carrier, points):
+        self.carrier = carrier
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+        if self.points.shape[1] != len(AXES):
+            raise ValueError("Scan points need one coordinate per axis")
+        self.logger = logging.getLogger('MainLogger.Scan')
+        self.program = None
+        self.progress = ScanProgress(0, len(self.points), 0.0, None, 0.0)
+        # Points measured (or swept) so far
+        self.visited = np.zeros(len(self.points), dtype=bool)
+
+    @classmethod
+    def grid(cls, carrier, x: tuple = None, y: tuple = None,
+             z: tuple = None, pitch=1.0, **kwargs):
+        """Serpentine grid over (start, stop) ranges in cm. pitch is one
+        value or one per axis. Axes without a range stay where they are"""
+        pitches = np.broadcast_to(np.asarray(pitch, dtype=float), (3,))
+        values = [
+            axis_values(limits, pitches[axis]) if limits is not None
+            else [carrier.get_position(axis)]
+            for axis, limits in enumerate((x, y, z))]
+        return cls(carrier, serpentine(*values), **kwargs)
+
+    def compile(self) -> MotionProgram:
+        """Check all points against the software limits and pre-encode
+        the moves, raising OutOfLimitException before anything moves"""
+        self.program = MotionProgram.for_carrier(self.carrier, self.points)
+        return self.program
+
+    def run(self, measure=None, progress=None, start: int = 0,
+            recorder=None) -> list:
+        """Move to every point from index start on and call
+        measure(index, point) there. progress(ScanProgress) is called
+        after every point. Returns the measured values.
+
+        With a recorder.ScanRecorder, points it holds as complete are
+        skipped and the values go to its file instead of the returned
+        list, so memory use does not grow with the scan.
+
+        A carrier stop() during the scan, also between two points, ends
+        it with StoppedException"""
+        stops = self.carrier._stops
+        program = self.compile()
+        indices = []
+        for index in range(start, len(self.points)):
+            if recorder is not None and recorder.is_done(index):
+                self.visited[index] = True
+            else:
+                indices.append(index)
+        results = []
+        began = monotonic()
+        for done, index in enumerate(indices, 1):
+            self._check_stop(stops, index)
+            if not self.carrier.execute(program, index, wait=True):
+                self._check_stop(stops, index)
+                raise PeripheryException(
+                    'Scan point {0} not reached'.format(index))
+            if measure is not None:
+                value = measure(index, self.points[index])
+                if recorder is None:
+                    results.append(value)
+                else:
+                    recorder.record(index, self.carrier._steps, value)
+            self.visited[index] = True
+            self._report(done, len(indices), began, progress)
+        return results
+
+    def fly(self, velocity: int = None, progress=None) -> np.ndarray:
+        """Sweep every row (consecutive points differing only in x) in
+        one fly move from its first to its last point, see
+        Carrier.fly_to_xyz. progress(ScanProgress) is called after every
+        row. Returns the (N, 4) array of (t, x, y, z) samples. A stop
+        ends the sweep with StoppedException, as in run"""
+        stops = self.carrier._stops
+        self.compile()
+        points = self.points
+        total = len(points)
+        breaks = np.flatnonzero(
+            np.any(np.diff(points[:, 1:], axis=0) != 0, axis=1)) + 1
+        samples = []
+        began = monotonic()
+        for first, last in zip(np.concatenate(([0], breaks)),
+                               np.concatenate((breaks, [total])) - 1):
+            self._check_stop(stops, first)
+            if not self.carrier.move_to_xyz(*points[first], wait=True):
+                self._check_stop(stops, first)
+                raise PeripheryException(
+                    'Scan point {0} not reached'.format(first))
+            sampler = self.carrier.fly_to_xyz(x=points[last][0],
+                                              velocity=velocity)
+            if not sampler.reached:
+                self._check_stop(stops, last)
+                raise PeripheryException(
+                    'Scan point {0} not reached'.format(last))
+            samples.append(np.array(sampler.samples).reshape(-1, 4))
+            self.visited[first:last + 1] = True
+            self._report(int(last) + 1, total, began, progress)
+        return np.vstack(samples)
+
+    def _check_stop(self, stops: int, index: int):
+        # The carrier counts its stops; one since the start ends the scan
+        if self.carrier._stops != stops:
+            raise StoppedException(
+                'Scan stopped before point {0}'.format(index))
+
+    def _report(self, done: int, total: int, began: float, progress):
+        elapsed = monotonic() - began
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate else None
+        self.progress = ScanProgress(done, total, elapsed, eta, rate)
+        if progress is not None:
+            progress(self.progress)
+        elif done % 100 == 0 or done == total:
+            self.logger.info("Scan %d/%d points, %.1f points/s, ETA %.0f s",
+                             done, total, rate, eta or 0.0)
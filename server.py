@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Local gantry server: one process owns the Carrier, many clients use it.
+
+GantryServer runs a CarrierWorker and accepts connections on localhost
+TCP or a Unix socket. Requests from all clients go through the worker's
+queue, so they are executed one at a time; identical queries that are
+waiting at the same time are answered by a single call. The worker's
+periodic position poll is pushed to every subscribed client and served
+to status requests, so any number of clients share one poll.
+
+The protocol is one JSON object per line. A request
+
+    {"id": 7, "method": "move_to", "args": [10.0, 0], "kwargs": {}}
+
+is answered with {"id": 7, "result": ...} or {"id": 7, "error": {"type":
+..., "message": ...}}. Subscribers also receive {"status": {...}} lines.
+"stop" skips the queue: it stops the gantry at once, cancels all queued
+requests and answers with the stop latency in seconds.
+
+    python server.py --port 7878            # owns the serial port
+    client = GantryClient()                 # in any other process
+    client.carrier.move_to(10.0, 0, wait=True)
+"""
+
+import argparse
+import json
+import logging
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+from itertools import count
+
+from linact import VELOCITY_PROFILE, Carrier
+from periphery import (OutOfLimitException, PeripheryException,
+                       ReplyMismatchException, ResponseTimeoutException)
+from worker import CarrierWorker
+
+DEFAULT_ADDRESS = ('127.0.0.1', 7878)
+# Carrier methods clients may call. shutdown closes the port for all
+# clients, so only the server does it (GantryServer.close)
+METHODS = ('initialize', 'move_to', 'move_to_xyz',
+           'move_by_xyz', 'wait_until_idle', 'stop', 'get_position',
+           'get_positions', 'sync_position', 'get_begin_velocity',
+           'get_end_velocity', 'get_begin_velocities', 'get_end_velocities',
+           '_set_begin_velocity', '_set_end_velocity', '_move', 'limits')
+# Methods without side effects: concurrent identical calls share a result
+QUERIES = ('get_position', 'get_positions', 'get_begin_velocity',
+           'get_end_velocity', 'get_begin_velocities', 'get_end_velocities',
+           'limits')
+_EXCEPTIONS = {exception.__name__: exception for exception in
+               (OutOfLimitException, ReplyMismatchException,
+                ResponseTimeoutException)}
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, default=str).encode() + b'\n'
+
+
+def _error(exception: Exception) -> dict:
+    return {'type': type(exception).__name__,
+            'message': getattr(exception, 'message', str(exception)),
+            'expression': getattr(exception, 'expression', None)}
+
+
+class _Connection(socketserver.StreamRequestHandler):
+    """One client: reads requests, writes replies and status updates"""
+
+    def setup(self):
+        super().setup()
+        self._send_lock = threading.Lock()
+
+    def handle(self):
+        gantry = self.server.gantry
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    self._request(gantry, line)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            gantry.unsubscribe(self)
+
+    def _request(self, gantry, line: bytes):
+        try:
+            request = json.loads(line)
+            method = request['method']
+            args = request.get('args', [])
+            kwargs = request.get('kwargs', {})
+        except (ValueError, KeyError, TypeError) as exception:
+            self.send({'id': None, 'error': _error(exception)})
+            return
+        identifier = request.get('id')
+        if method == 'subscribe':
+            gantry.subscribe(self)
+            self.send({'id': identifier, 'result': gantry.worker.status()})
+        elif method == 'unsubscribe':
+            gantry.unsubscribe(self)
+            self.send({'id': identifier, 'result': True})
+        elif method == 'status':
+            self.send({'id': identifier, 'result': gantry.worker.status()})
+        elif method == 'stop':
+            # Not queued: stops at once and cancels the queue
+            try:
+                self.send({'id': identifier, 'result': gantry.worker.halt()})
+            except Exception as exception:
+                self.send({'id': identifier, 'error': _error(exception)})
+        else:
+            gantry.call(method, args, kwargs).add_done_callback(
+                lambda future: self._reply(identifier, future))
+
+    def _reply(self, identifier, future: Future):
+        if future.cancelled():
+            message = {'id': identifier,
+                       'error': {'type': 'PeripheryException',
+                                 'message': 'Cancelled'}}
+        elif future.exception() is not None:
+            message = {'id': identifier, 'error': _error(future.exception())}
+        else:
+            message = {'id': identifier, 'result': future.result()}
+        self.send(message)
+
+    def send(self, message: dict):
+        try:
+            with self._send_lock:
+                self.wfile.write(_encode(message))
+                self.wfile.flush()
+        except (ConnectionError, OSError, ValueError):
+            # Client gone, handle() cleans up
+            pass
+
+
+class GantryServer:
+    """Shares one Carrier between the clients of a local socket"""
+
+    def __init__(self, carrier: Carrier, address=DEFAULT_ADDRESS,
+                 status_interval: float = 0.5):
+        self.carrier = carrier
+        self.logger = logging.getLogger('MainLogger.GantryServer')
+        self.worker = CarrierWorker(carrier, status_interval)
+        if isinstance(address, str):
+            self._server = _UnixServer(address, _Connection)
+        else:
+            self._server = _TCPServer(tuple(address), _Connection)
+        self._server.gantry = self
+        self.address = self._server.server_address
+        self._subscribers = set()
+        # (method, arguments) -> Future of queries waiting to run
+        self._waiting = {}
+        self._lock = threading.Lock()
+        # Latest status not yet pushed, handed to the broadcast thread
+        self._status = None
+        self._status_ready = threading.Condition(self._lock)
+        self._running = False
+
+    def call(self, method: str, args, kwargs) -> Future:
+        """Queue a Carrier method on the worker. Identical queries that
+        have not started yet share one Future"""
+        if method not in METHODS:
+            future = Future()
+            future.set_exception(PeripheryException(
+                'Unknown method {0}'.format(method)))
+            return future
+        function = getattr(self.carrier, method)
+        if method not in QUERIES:
+            return self.worker.submit(function, *args, **kwargs)
+        key = (method, json.dumps([args, kwargs], sort_keys=True))
+        with self._lock:
+            future = self._waiting.get(key)
+            if future is None:
+                future = self.worker.submit(self._query, key, function,
+                                            args, kwargs)
+                self._waiting[key] = future
+        return future
+
+    def _query(self, key, function, args, kwargs):
+        # From now on a new request needs a new call
+        with self._lock:
+            self._waiting.pop(key, None)
+        return function(*args, **kwargs)
+
+    def subscribe(self, connection: _Connection):
+        with self._lock:
+            self._subscribers.add(connection)
+
+    def unsubscribe(self, connection: _Connection):
+        with self._lock:
+            self._subscribers.discard(connection)
+
+    def _status_changed(self, status: dict):
+        # Runs on the worker thread: only hand the snapshot over
+        with self._lock:
+            self._status = status
+            self._status_ready.notify()
+
+    def _broadcast(self):
+        while self._running:
+            with self._lock:
+                while self._status is None and self._running:
+                    self._status_ready.wait()
+                status, self._status = self._status, None
+                subscribers = list(self._subscribers)
+            if status is not None:
+                for connection in subscribers:
+                    connection.send({'status': status})
+
+    def start(self):
+        """Start the worker and serve clients on background threads"""
+        self._running = True
+        self.worker.add_listener(self._status_changed)
+        self.worker.start()
+        threading.Thread(target=self._broadcast, name='GantryBroadcast',
+                         daemon=True).start()
+        threading.Thread(target=self._server.serve_forever,
+                         name='GantryServer', daemon=True).start()
+        self.logger.info("Serving the gantry on %s", self.address)
+
+    def serve_forever(self):
+        self.start()
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self, shutdown: bool = True):
+        """Stop serving. With shutdown, the carrier is shut down first"""
+        self._server.shutdown()
+        self._server.server_close()
+        if shutdown:
+            self.worker.submit(self.carrier.shutdown).result()
+        self.worker.stop()
+        with self._lock:
+            self._running = False
+            self._status_ready.notify()
+
+
+class _RemoteMethod:
+    """Carrier method of a GantryClient, blocking when called"""
+
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        return self.client.call(self.name, *args, **kwargs).result()
+
+
+class _CarrierProxy:
+    """Stands in for the server's Carrier: carrier.move_to(...) etc."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return _RemoteMethod(self._client, name)
+
+
+class GantryClient:
+    """Connection to a GantryServer.
+
+    Offers submit() and status() like a CarrierWorker, with the remote
+    carrier as its carrier attribute, so it can stand in for one"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, subscribe: bool = True):
+        self.logger = logging.getLogger('MainLogger.GantryClient')
+        family = socket.AF_UNIX if isinstance(address, str) \
+            else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(address if isinstance(address, str)
+                             else tuple(address))
+        self._file = self._socket.makefile('rwb')
+        self._send_lock = threading.Lock()
+        self._ids = count()
+        self._futures = {}
+        self._listeners = []
+        self._status = None
+        self.carrier = _CarrierProxy(self)
+        threading.Thread(target=self._read_loop, name='GantryClient',
+                         daemon=True).start()
+        if subscribe:
+            self._status = self.call('subscribe').result()
+
+    def call(self, method: str, *args, **kwargs) -> Future:
+        """Send a request, the Future resolves with its result"""
+        future = Future()
+        identifier = next(self._ids)
+        self._futures[identifier] = future
+        with self._send_lock:
+            self._file.write(_encode({'id': identifier, 'method': method,
+                                      'args': args, 'kwargs': kwargs}))
+            self._file.flush()
+        return future
+
+    def submit(self, function: _RemoteMethod, *args, **kwargs) -> Future:
+        """CarrierWorker.submit for methods of the carrier attribute"""
+        return self.call(function.name, *args, **kwargs)
+
+    def halt(self) -> float:
+        """CarrierWorker.halt on the server: stop now, cancel the queue"""
+        return self.call('stop').result()
+
+    def status(self) -> dict:
+        """Latest status pushed by the server (or asked for)"""
+        if self._status is None:
+            self._status = self.call('status').result()
+        return dict(self._status)
+
+    def add_listener(self, listener):
+        """Call listener(status) on the reader thread for every push"""
+        self._listeners.append(listener)
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+    def _read_loop(self):
+        try:
+            for line in self._file:
+                message = json.loads(line)
+                if 'status' in message:
+                    self._status = message['status']
+                    for listener in list(self._listeners):
+                        listener(self._status)
+                    continue
+                future = self._futures.pop(message.get('id'), None)
+                if future is None:
+                    continue
+                if 'error' in message:
+                    future.set_exception(self._exception(message['error']))
+                else:
+                    future.set_result(message['result'])
+        except (ConnectionError, OSError, ValueError):
+            pass
+        error = PeripheryException('Connection to the gantry server lost')
+        for future in list(self._futures.values()):
+            if not future.done():
+                future.set_exception(error)
+        self._futures.clear()
+
+    @staticmethod
+    def _exception(error: dict) -> Exception:
+        exception = _EXCEPTIONS.get(error.get('type'))
+        if exception is not None:
+            return exception(error.get('expression'), error.get('message'))
+        return PeripheryException(error.get('message'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Share the gantry with local clients')
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1],
+                        help='localhost TCP port')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='Unix socket to listen on instead of TCP')
+    parser.add_argument('--serial-port', help='serial port of the gantry')
+    parser.add_argument('--status-interval', type=float, default=0.5,
+                        help='seconds between two position polls')
+    parser.add_argument('--journal', default='motion_journal.jsonl',
+                        help='motion journal to resume from')
+    parser.add_argument('--profile', default=VELOCITY_PROFILE,
+                        help='velocity profile written by tuning.py')
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    carrier = Carrier(port=arguments.serial_port,
+                      profile=arguments.profile, journal=arguments.journal)
+    server = GantryServer(carrier,
+                          arguments.unix or (DEFAULT_ADDRESS[0],
+                                             arguments.port),
+                          arguments.status_interval)
+    server.worker.submit(carrier.initialize)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Software model of a three axis SimpleStep controller.
+
+SimpleStepSimulator behaves like a serial.Serial object, so it can be
+handed to Carrier directly:
+
+    carrier = Carrier(serial_connection=SimpleStepSimulator())
+
+or served on a pseudo-terminal that Carrier opens like a real port:
+
+    simulator = SimpleStepSimulator()
+    carrier = Carrier(port=simulator.open_pty())
+
+Only the command set used by linact.py is modelled (P, N, B, E, H,
+RNY+-n, m, v, b, e, *). Every addressed command of a line is answered
+with its own reply: the address and opcode, followed by the value for
+queries (e.g. b'X0m-3200\\r'). Rejected commands are answered with the
+address and a question mark (e.g. b'Y0?\\r'); this includes relative
+moves sent while the axis is still moving.
+
+Replies become readable after the line has been transferred at the
+given baud rate plus a fixed processing latency. Moves follow the
+trapezoidal profile of motion.py. With a stall_velocity, an axis losing
+torque is modelled: a move starting above it does not get going, and one
+ramping up beyond it stops where it crossed it.
+"""
+
+import os
+import re
+import select
+import threading
+from collections import deque
+from time import monotonic
+
+import motion
+
+# Splits a command line into addressed commands without breaking up
+# comma separated arguments such as "X0P3,128,17,0"
+_SPLIT_RE = re.compile(rb',(?=[XYZ]\d)')
+# Bits on the wire per byte (start + 8 data + stop)
+_BITS_PER_BYTE = 10
+
+
+class _Axis:
+    """State of a single simulated axis"""
+    def __init__(self, begin_velocity: int, end_velocity: int,
+                 acceleration: float, stall_velocity: int = None):
+        self.begin_velocity = begin_velocity
+        self.end_velocity = end_velocity
+        self.acceleration = acceleration
+        self.stall_velocity = stall_velocity
+        self.microstep = 0
+        self.power = b''
+        # Current move: counter at its start, signed length, start time
+        # and the velocities that were in force when it started
+        self.origin = 0
+        self.steps = 0
+        self.start = 0.0
+        self.profile = (begin_velocity, end_velocity)
+
+    def _args(self):
+        return self.steps, self.profile[0], self.profile[1], \
+            self.acceleration
+
+    def position(self, now: float) -> int:
+        done = int(motion.travelled(now - self.start, *self._args()))
+        return self.origin + done if self.steps >= 0 else self.origin - done
+
+    def velocity(self, now: float) -> int:
+        return int(motion.velocity(now - self.start, *self._args()))
+
+    def busy(self, now: float) -> bool:
+        return now < self.start + motion.duration(*self._args())
+
+    def move(self, steps: int, now: float):
+        self.origin = self.position(now)
+        self.steps = self._stalled(steps)
+        self.start = now
+        self.profile = (self.begin_velocity, self.end_velocity)
+
+    def _stalled(self, steps: int) -> int:
+        """Steps actually taken by a move of the given length"""
+        stall = self.stall_velocity
+        if stall is None or self.end_velocity <= stall:
+            return steps
+        if self.begin_velocity > stall:
+            return 0
+        # Steps ramping up from the begin to the stall velocity
+        reached = int((stall ** 2 - self.begin_velocity ** 2) /
+                      (2 * self.acceleration))
+        if reached >= abs(steps) // 2:
+            return steps
+        return reached if steps > 0 else -reached
+
+    def halt(self, now: float):
+        self.origin = self.position(now)
+        self.steps = 0
+
+
+class SimpleStepSimulator:
+    """Serial-like stand-in for a SimpleStep motion controller"""
+
+    def __init__(self, latency: float = 0.002, baudrate: int = 115200,
+                 acceleration: float = 20000, begin_velocity: int = 100,
+                 end_velocity: int = 6000, max_velocity: int = 20000,
+                 stall_velocity: int = None):
+        self.latency = latency
+        self.baudrate = baudrate
+        self.max_velocity = max_velocity
+        # Seconds read() blocks at most, None blocks until data arrives
+        self.timeout = None
+        self.is_open = True
+        self.axes = {name: _Axis(begin_velocity, end_velocity,
+                                 acceleration, stall_velocity)
+                     for name in (b'X', b'Y', b'Z')}
+        self._line = bytearray()
+        self._ready = bytearray()
+        # (time the reply is complete on the host side, reply)
+        self._pending = deque()
+        self._last_ready = 0.0
+        self._condition = threading.Condition()
+        self._pty = None
+
+    # serial.Serial interface
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        if self._pty is not None:
+            for fd in self._pty:
+                os.close(fd)
+            self._pty = None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._condition:
+            self._release(monotonic())
+            return len(self._ready)
+
+    def write(self, data: bytes) -> int:
+        now = monotonic()
+        with self._condition:
+            arrival = now + len(data) * _BITS_PER_BYTE / self.baudrate
+            self._line += data
+            while True:
+                end = self._line.find(b'\r')
+                if end < 0:
+                    break
+                line = bytes(self._line[:end])
+                del self._line[:end + 1]
+                self._execute(line, arrival + self.latency)
+            self._condition.notify_all()
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = None if self.timeout is None \
+            else monotonic() + self.timeout
+        with self._condition:
+            while True:
+                now = monotonic()
+                self._release(now)
+                if len(self._ready) >= size or \
+                        (deadline is not None and now >= deadline):
+                    break
+                wait = None if deadline is None else deadline - now
+                if self._pending:
+                    upcoming = self._pending[0][0] - now
+                    wait = upcoming if wait is None else min(wait, upcoming)
+                self._condition.wait(wait)
+            received = bytes(self._ready[:size])
+            del self._ready[:size]
+        return received
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._ready.clear()
+            self._pending.clear()
+
+    def reset_output_buffer(self):
+        with self._condition:
+            self._line.clear()
+
+    def flush(self):
+        pass
+
+    # Pseudo-terminal transport
+    def open_pty(self) -> str:
+        """Serve the simulator on a pseudo-terminal and return its path"""
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self._pty = (master, slave)
+        threading.Thread(target=self._serve_pty, args=(master,),
+                         name='SimpleStep pty', daemon=True).start()
+        return os.ttyname(slave)
+
+    def _serve_pty(self, master: int):
+        while self.is_open and self._pty is not None:
+            with self._condition:
+                self._release(monotonic())
+                wait = 0.05
+                if self._pending:
+                    wait = max(0.0, min(wait, self._pending[0][0] -
+                                        monotonic()))
+            try:
+                readable, _, _ = select.select([master], [], [], wait)
+                if readable:
+                    self.write(os.read(master, 4096))
+                with self._condition:
+                    self._release(monotonic())
+                    outgoing = bytes(self._ready)
+                    self._ready.clear()
+                if outgoing:
+                    os.write(master, outgoing)
+            except OSError:
+                break
+
+    # Controller model
+    def _release(self, now: float):
+        while self._pending and self._pending[0][0] <= now:
+            self._ready += self._pending.popleft()[1]
+
+    def _reply(self, data: bytes, when: float):
+        ready = when + len(data) * _BITS_PER_BYTE / self.baudrate
+        self._last_ready = max(ready, self._last_ready)
+        self._pending.append((self._last_ready, data))
+
+    def _execute(self, line: bytes, when: float):
+        for command in _SPLIT_RE.split(line):
+            address = command[:2]
+            axis = self.axes.get(command[:1])
+            if axis is None:
+                self._reply(address + b'?\r', when)
+                continue
+            try:
+                reply = self._command(axis, command[2:], when)
+            except ValueError:
+                reply = None
+            if reply is None:
+                self._reply(address + b'?\r', when)
+            else:
+                self._reply(address + reply + b'\r', when)
+
+    def _command(self, axis: _Axis, body: bytes, now: float):
+        """Apply one command to an axis, return the reply or None"""
+        opcode = body[:1]
+        if body.startswith(b'RNY'):
+            if axis.busy(now):
+                return None
+            axis.move(int(body[3:]), now)
+            return b'R'
+        if opcode == b'*':
+            axis.halt(now)
+            return opcode
+        if opcode == b'N':
+            if axis.busy(now):
+                return None
+            axis.origin, axis.steps = 0, 0
+            return opcode
+        if opcode in (b'B', b'E'):
+            value = int(body[1:])
+            if not 0 < value <= self.max_velocity:
+                return None
+            if opcode == b'B':
+                axis.begin_velocity = value
+            else:
+                axis.end_velocity = value
+            return opcode
+        if opcode == b'H':
+            axis.microstep = int(body[1:])
+            return opcode
+        if opcode == b'P':
+            axis.power = body[1:]
+            return opcode
+        if opcode == b'm':
+            return opcode + str(axis.position(now)).encode()
+        if opcode == b'v':
+            return opcode + str(axis.velocity(now)).encode()
+        if opcode == b'b':
+            return opcode + str(axis.begin_velocity).encode()
+        if opcode == b'e':
+            return opcode + str(axis.end_velocity).encode()
+        return None
+
+
+if __name__ == '__main__':
+    simulator = SimpleStepSimulator()
+    print("SimpleStep simulator listening on " + simulator.open_pty())
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        simulator.close()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests: Carriers driven by the simulator.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linact import Carrier  # noqa: E402
+from simulator import SimpleStepSimulator  # noqa: E402
+
+
+def make_carrier(simulator=None, initialize: bool = True, **kwargs):
+    """Carrier on a simulator, initialized unless told otherwise"""
+    carrier = Carrier(serial_connection=simulator or SimpleStepSimulator(),
+                      **kwargs)
+    if initialize:
+        carrier.initialize()
+    return carrier
+
+
+def drop_replies(simulator, prefix: bytes, count: int = 1):
+    """Make the simulator swallow its next count replies starting with
+    prefix, like a reply lost on the line"""
+    reply = simulator._reply
+    dropped = []
+
+    def lossy(data, when):
+        if len(dropped) < count and data.startswith(prefix):
+            dropped.append(data)
+            return
+        reply(data, when)
+    simulator._reply = lossy
+    return dropped
+
+
+def record_writes(simulator) -> list:
+    """Keep every command line written to the simulator in a list"""
+    lines = []
+    write = simulator.write
+
+    def recording(data):
+        lines.append(bytes(data))
+        return write(data)
+    simulator.write = recording
+    return lines
+
+
+@pytest.fixture
+def simulator():
+    return SimpleStepSimulator()
+
+
+@pytest.fixture
+def carrier(simulator):
+    return make_carrier(simulator)
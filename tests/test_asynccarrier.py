@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncCarrier against the simulator, including lost and late replies.
+"""
+
+import asyncio
+from time import monotonic
+
+import pytest
+
+from asynccarrier import AsyncCarrier
+from conftest import drop_replies, make_carrier
+from journal import MotionJournal
+from periphery import ResponseTimeoutException
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_queries(simulator):
+    async def scenario():
+        carrier = AsyncCarrier(make_carrier(simulator, initialize=False))
+        await carrier.initialize()
+        await carrier.move_to_xyz(1.0, 2.0, 3.0, wait=True)
+        positions = await asyncio.gather(*(
+            carrier.get_position(axis, refresh=True) for axis in range(3)))
+        await carrier.close()
+        return positions
+    assert run(scenario()) == pytest.approx([1.0, 2.0, 3.0])
+
+
+def test_lost_reply_does_not_shift_later_replies(simulator):
+    async def scenario():
+        carrier = AsyncCarrier(make_carrier(simulator, initialize=False))
+        await carrier.initialize()
+        carrier.carrier.constants["read_timeout"] = 0.05
+        drop_replies(simulator, b'X0m')
+        with pytest.raises(ResponseTimeoutException):
+            await carrier.get_position(0, refresh=True)
+        velocities = [await carrier.get_end_velocity(axis, refresh=True)
+                      for axis in range(3)]
+        # A late reply to the timed-out query is dropped
+        simulator._reply(b'X0m0\r', monotonic())
+        velocities.append(await carrier.get_begin_velocity(0, refresh=True))
+        await carrier.close()
+        return velocities
+    assert run(scenario()) == [6000, 6000, 6000, 100]
+
+
+def test_shutdown_returns_home_after_a_running_move(simulator):
+    async def scenario():
+        carrier = AsyncCarrier(make_carrier(simulator, initialize=False))
+        await carrier.initialize()
+        await carrier.move_to_xyz(0.5, 0.25, 0.5)
+        await carrier.shutdown()
+    run(scenario())
+    now = monotonic()
+    assert [axis.position(now) for axis in simulator.axes.values()] == \
+        [0, 0, 0]
+
+
+def test_resume_from_the_journal(simulator, tmp_path):
+    path = str(tmp_path / 'motion_journal.jsonl')
+    make_carrier(simulator, journal=path).move_to_xyz(1.0, 2.0, 3.0,
+                                                      wait=True)
+
+    async def scenario():
+        carrier = AsyncCarrier(make_carrier(simulator, initialize=False,
+                                            journal=path))
+        await carrier.initialize()
+        positions = await asyncio.gather(*(
+            carrier.get_position(axis, refresh=True) for axis in range(3)))
+        await carrier.close()
+        return positions
+    assert run(scenario()) == pytest.approx([1.0, 2.0, 3.0])
+    assert MotionJournal(path).last()["event"] == 'resume'
+
+
+def test_power_cycled_controller_is_initialized(tmp_path):
+    path = str(tmp_path / 'motion_journal.jsonl')
+    make_carrier(journal=path).move_to_xyz(1.0, 2.0, 3.0, wait=True)
+
+    async def scenario():
+        carrier = AsyncCarrier(make_carrier(initialize=False, journal=path))
+        await carrier.initialize()
+        positions = await asyncio.gather(*(
+            carrier.get_position(axis, refresh=True) for axis in range(3)))
+        await carrier.close()
+        return positions
+    assert run(scenario()) == [0.0, 0.0, 0.0]
+    assert MotionJournal(path).last()["event"] == 'initialize'
+
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness: results document and baseline comparison.
+"""
+
+import benchmark
+
+
+def document(**values) -> dict:
+    return {'meta': {}, 'results': {
+        name: {'value': value, 'better': better}
+        for name, (value, better) in values.items()}}
+
+
+def test_regressions_in_both_directions():
+    baseline = document(latency=(1.0, 'lower'), rate=(100.0, 'higher'),
+                        steady=(1.0, 'lower'))
+    current = document(latency=(1.2, 'lower'), rate=(80.0, 'higher'),
+                       steady=(1.05, 'lower'))
+    rows = {row[0]: row for row in benchmark.compare(current, baseline)}
+    assert rows['latency'][3] < -0.1 and rows['latency'][4]
+    assert rows['rate'][3] < -0.1 and rows['rate'][4]
+    assert not rows['steady'][4]
+
+
+def test_improvements_are_positive():
+    rows = benchmark.compare(document(latency=(0.5, 'lower')),
+                             document(latency=(1.0, 'lower')))
+    assert rows == [('latency', 1.0, 0.5, 0.5, False)]
+
+
+def test_skipped_and_new_results_are_not_compared():
+    current = document(new=(1.0, 'lower'))
+    current['results']['gui.frame'] = {'skipped': 'no GUI'}
+    baseline = document(**{'gui.frame': (1.0, 'lower')})
+    assert benchmark.compare(current, baseline) == []
+
+
+def test_run_produces_a_document():
+    results = benchmark.run(repeats=2)['results']
+    for name in ('query.get_position', 'moves.single_axis',
+                 'lifecycle.initialize'):
+        assert results[name]['value'] > 0
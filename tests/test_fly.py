@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Fly moves: timestamped positions sampled while the carrier moves.
+"""
+
+import numpy as np
+import pytest
+
+from scan import Scan
+
+
+def test_fly_samples_the_whole_move(carrier):
+    sampler = carrier.fly_to_xyz(x=0.5)
+    assert sampler.reached
+    samples = np.frombuffer(sampler.samples).reshape(-1, 4)
+    assert len(samples) == len(sampler) > 2
+    assert np.all(np.diff(samples[:, 0]) > 0)
+    assert np.all(np.diff(samples[:, 1]) >= 0)
+    assert samples[-1, 1:] == pytest.approx([0.5, 0.0, 0.0])
+
+
+def test_fly_velocity_is_restored(carrier):
+    sampler = carrier.fly_to_xyz(x=0.25, velocity=3000)
+    assert sampler.reached
+    assert carrier.get_end_velocities(refresh=True) == [6000] * 3
+
+
+def test_scan_flies_every_row(carrier):
+    scan = Scan.grid(carrier, x=(0, 0.2), y=(0, 0.1), pitch=0.1)
+    samples = scan.fly()
+    assert set(np.round(samples[:, 2], 6)) == {0.0, 0.1}
+    assert scan.progress.done == len(scan.points)
+    assert carrier.get_positions(refresh=True) == \
+        pytest.approx(scan.points[-1])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Controller discovery and CarrierGroup.
+"""
+
+from collections import namedtuple
+from time import monotonic
+
+import pytest
+
+import linact
+from conftest import make_carrier
+from group import CarrierGroup
+from simulator import SimpleStepSimulator
+
+PortInfo = namedtuple('PortInfo', ['device', 'pid', 'serial_number'])
+
+
+def test_discovery_is_cached(monkeypatch):
+    scans = []
+
+    def comports():
+        scans.append(True)
+        return [PortInfo('/dev/ttyUSB0', linact.CONTROLLER_PID, 'A1'),
+                PortInfo('/dev/ttyS0', None, None)]
+    monkeypatch.setattr(linact, 'comports', comports)
+    monkeypatch.setattr(linact, '_discovered', None)
+    assert [device.device for device in linact.find_controllers()] == \
+        ['/dev/ttyUSB0']
+    linact.find_controllers()
+    assert len(scans) == 1
+    linact.find_controllers(refresh=True)
+    assert len(scans) == 2
+
+
+def test_group_initializes_in_parallel():
+    group = CarrierGroup([make_carrier(SimpleStepSimulator(latency=0.02),
+                                       initialize=False) for _ in range(3)])
+    began = monotonic()
+    group.initialize()
+    parallel = monotonic() - began
+    single = make_carrier(SimpleStepSimulator(latency=0.02),
+                          initialize=False)
+    began = monotonic()
+    single.initialize()
+    assert parallel < 2 * (monotonic() - began)
+    assert group.map(linact.Carrier.get_end_velocity, 0) == [6000] * 3
+
+
+def test_group_raises_after_every_call_finished():
+    group = CarrierGroup([make_carrier() for _ in range(2)])
+    results = []
+
+    def call(carrier):
+        results.append(carrier)
+        if carrier is group[0]:
+            raise ValueError('broken')
+    with pytest.raises(ValueError):
+        group.map(call)
+    assert len(results) == 2
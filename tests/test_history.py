@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+PositionHistory: ring buffer wraparound and decimation.
+"""
+
+import numpy as np
+
+from history import PositionHistory
+
+
+def filled(capacity: int, count: int) -> PositionHistory:
+    history = PositionHistory(capacity)
+    for index in range(count):
+        history.append(float(index), [index, 2 * index, None])
+    return history
+
+
+def test_oldest_samples_are_overwritten():
+    history = filled(5, 8)
+    assert len(history) == history.capacity == 5
+    assert history.array()[:, 0].tolist() == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert history.last()[:3].tolist() == [7.0, 7.0, 14.0]
+    assert np.isnan(history.array()[:, 3]).all()
+
+
+def test_partly_filled():
+    history = filled(5, 3)
+    assert history.array()[:, 0].tolist() == [0.0, 1.0, 2.0]
+    assert PositionHistory(5).last() is None
+
+
+def test_decimated_keeps_the_newest():
+    history = filled(1000, 1500)
+    for points in (1, 7, 100, 999):
+        samples = history.decimated(points)
+        assert 0 < len(samples) <= points
+        assert samples[-1, 0] == 1499.0
+        assert np.all(np.diff(samples[:, 0]) > 0)
+    assert len(history.decimated(2000)) == 1000
+
+
+def test_version_tracks_changes():
+    history = filled(5, 3)
+    assert history.version == 3
+    history.clear()
+    assert len(history) == 0 and history.version == 4
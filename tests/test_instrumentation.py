@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Per-command statistics: grouping, percentiles and export formats.
+"""
+
+import pytest
+
+from instrumentation import CommandStats, command_type
+
+
+def test_command_type():
+    assert command_type(b'X0m\r') == 'Xm'
+    assert command_type(b'X0RNY+10,Y0RNY-5\r') == 'XR,YR'
+    assert command_type(b'garbage') == '?'
+
+
+@pytest.fixture
+def stats():
+    stats = CommandStats()
+    for _ in range(90):
+        stats.record(b'X0m\r', 6, 0.0012)
+    for _ in range(10):
+        stats.record(b'X0m\r', 6, 0.12)
+    stats.record(b'X0m\r', 0)
+    return stats
+
+
+def test_percentiles(stats):
+    entry = stats.snapshot()['Xm']
+    assert entry['count'] == 101
+    assert entry['timeouts'] == 1
+    assert entry['bytes_out'] == 4 * 101
+    assert entry['mean'] == pytest.approx((90 * 0.0012 + 10 * 0.12) / 100)
+    # Upper edge of the log-spaced bucket, ten per decade
+    assert entry['p50'] == pytest.approx(10 ** -2.9)
+    # Capped at the largest latency seen
+    assert entry['p95'] == entry['p99'] == entry['max'] == 0.12
+
+
+def test_prometheus_output(stats, tmp_path):
+    path = str(tmp_path / 'carrier.prom')
+    stats.to_prometheus(path)
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert '# TYPE carrier_commands_total counter' in lines
+    assert 'carrier_commands_total{command="Xm"} 101' in lines
+    assert 'carrier_timeouts_total{command="Xm"} 1' in lines
+    assert 'carrier_latency_seconds_bucket{command="Xm",le="+Inf"} 100' \
+        in lines
+    assert 'carrier_latency_seconds_count{command="Xm"} 100' in lines
+    buckets = [int(line.rsplit(' ', 1)[1]) for line in lines
+               if line.startswith('carrier_latency_seconds_bucket')]
+    # Cumulative counts never decrease
+    assert buckets == sorted(buckets)
+
+
+def test_csv_output(stats, tmp_path):
+    path = str(tmp_path / 'latency.csv')
+    stats.to_csv(path)
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert lines[0].startswith('command,count,timeouts')
+    assert lines[1].startswith('Xm,101,1,')
+
+
+def test_carrier_records_its_commands(carrier):
+    stats = carrier.instrument()
+    carrier.get_position(0, refresh=True)
+    carrier.get_position(1, refresh=True)
+    snapshot = stats.snapshot()
+    assert snapshot['Xm']['count'] == snapshot['Ym']['count'] == 1
+    assert snapshot['Xm']['bytes_in'] == len(b'X0m0\r')
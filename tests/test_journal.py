@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Resuming from the motion journal against a controller that kept its
+state and against a fresh (power cycled) one.
+"""
+
+import json
+
+import pytest
+
+from conftest import make_carrier
+from journal import MotionJournal
+from simulator import SimpleStepSimulator
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'motion_journal.jsonl')
+
+
+def configured(simulator) -> bool:
+    """Whether power mode and 1/8-step mode were sent to every axis"""
+    return all(axis.microstep == 3 and axis.power
+               for axis in simulator.axes.values())
+
+
+def test_resume_keeps_the_frame(path):
+    simulator = SimpleStepSimulator()
+    carrier = make_carrier(simulator, journal=path)
+    carrier.move_to_xyz(1.0, 2.0, 3.0, wait=True)
+    # New session on the same controller, e.g. after a crash
+    resumed = make_carrier(simulator, journal=path)
+    assert resumed.get_positions() == pytest.approx([1.0, 2.0, 3.0])
+    assert resumed.get_positions(refresh=True) == \
+        pytest.approx([1.0, 2.0, 3.0])
+    assert MotionJournal(path).last()["event"] == 'resume'
+
+
+def test_power_cycled_controller_is_initialized(path):
+    carrier = make_carrier(journal=path)
+    carrier.move_to_xyz(1.0, 2.0, 3.0, wait=True)
+    # The controller lost its counters and settings
+    simulator = SimpleStepSimulator()
+    fresh = make_carrier(simulator, journal=path)
+    assert configured(simulator)
+    assert MotionJournal(path).last()["event"] == 'initialize'
+    assert fresh.get_positions(refresh=True) == [0.0, 0.0, 0.0]
+
+
+def test_shutdown_is_never_resumed(path):
+    carrier = make_carrier(journal=path)
+    carrier.move_to_xyz(1.0, 2.0, 3.0, wait=True)
+    carrier.shutdown()
+    assert MotionJournal(path).last()["configured"] is False
+    simulator = SimpleStepSimulator()
+    make_carrier(simulator, journal=path)
+    assert configured(simulator)
+    assert MotionJournal(path).last()["event"] == 'initialize'
+
+
+def test_shutdown_away_from_home_stays_resumable(path):
+    simulator = SimpleStepSimulator()
+    carrier = make_carrier(simulator, journal=path)
+    carrier.move_to_xyz(1.0, 2.0, 3.0, wait=True)
+    # The X axis no longer gets going
+    simulator.axes[b'X'].stall_velocity = 50
+    carrier.shutdown()
+    assert MotionJournal(path).last()["configured"] is True
+    resumed = make_carrier(simulator, journal=path)
+    assert MotionJournal(path).last()["event"] == 'resume'
+    assert resumed.get_positions(refresh=True) == \
+        pytest.approx([1.0, 0.0, 0.0])
+
+
+def test_resume_after_a_stop(path):
+    simulator = SimpleStepSimulator()
+    carrier = make_carrier(simulator, journal=path)
+    carrier.move_to(1.0, 0, wait=True)
+    carrier.move_to(10.0, 0)
+    carrier.stop()
+    assert MotionJournal(path).last()["steps"] == [None] * 3
+    resumed = make_carrier(simulator, journal=path)
+    # The lost counter is taken from the controller
+    position = resumed.get_position(0)
+    assert 1.0 <= position < 10.0
+    assert resumed.get_position(0, refresh=True) == position
+    assert MotionJournal(path).last()["event"] == 'resume'
+
+
+def test_resume_sends_power_and_step_mode(path):
+    simulator = SimpleStepSimulator()
+    carrier = make_carrier(simulator, journal=path)
+    carrier.move_to(1.0, 0, wait=True)
+    for axis in simulator.axes.values():
+        axis.microstep = 0
+        axis.power = b''
+    make_carrier(simulator, journal=path)
+    assert configured(simulator)
+
+
+def test_journal_stays_small(path):
+    journal = MotionJournal(path, compact_every=10)
+    for index in range(35):
+        journal.append({"index": index})
+    journal.close()
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert len(lines) <= 10
+    assert json.loads(lines[-1]) == {"index": 34}
+
+
+def test_last_skips_a_torn_line(path):
+    journal = MotionJournal(path)
+    # Longer than one block read from the end of the file
+    for index in range(100):
+        journal.append({"index": index, "padding": 'x' * 100})
+    journal.close()
+    with open(path, 'a') as file:
+        file.write('{"index": 1')
+    assert journal.last()["index"] == 99
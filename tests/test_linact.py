@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Carrier I/O against the simulator.
+"""
+
+from time import monotonic, sleep
+
+import pytest
+
+import motion
+from conftest import drop_replies, make_carrier, record_writes
+from linact import Carrier
+from periphery import ReplyMismatchException, ResponseTimeoutException
+from simulator import SimpleStepSimulator
+
+
+def test_read_returns_every_reply_of_a_line():
+    # At a low baud rate the replies come in over several reads
+    carrier = make_carrier(SimpleStepSimulator(baudrate=9600))
+    carrier._write(b'X0m,Y0m,Z0m\r')
+    assert carrier._read() == b'X0m0\rY0m0\rZ0m0\r'
+
+
+def test_read_timeout(carrier, simulator):
+    carrier.constants["read_timeout"] = 0.05
+    drop_replies(simulator, b'X0m')
+    with pytest.raises(ResponseTimeoutException):
+        carrier.get_position(0, refresh=True)
+    # Nothing is left in flight to shift later replies
+    assert carrier.get_end_velocity(0, refresh=True) == 6000
+
+
+def test_late_reply_is_not_handed_to_the_next_command(carrier, simulator):
+    carrier.constants["read_timeout"] = 0.05
+    drop_replies(simulator, b'X0m')
+    with pytest.raises(ResponseTimeoutException):
+        carrier.get_position(0, refresh=True)
+    # The X0m reply turns up after the timeout
+    simulator._reply(b'X0m0\r', monotonic())
+    assert carrier.get_end_velocities(refresh=True) == [6000] * 3
+    assert carrier.get_begin_velocities(refresh=True) == [100] * 3
+
+
+def test_reply_to_another_command_raises():
+    with pytest.raises(ReplyMismatchException):
+        Carrier._to_steps(b'X0e6000\r', b'X0m\r')
+
+
+def test_initialize_configures_every_axis(carrier, simulator):
+    for axis in simulator.axes.values():
+        assert axis.microstep == 3
+        assert axis.power == b'3,128,17,0'
+        assert (axis.begin_velocity, axis.end_velocity) == (100, 6000)
+
+
+def test_move_to(carrier):
+    for axis, position in enumerate((0.25, -0.25, 0.25)):
+        carrier.move_to(position, axis)
+    sleep(motion.duration(800, 100, 6000, 20000) + 0.05)
+    assert [carrier.get_position(axis) for axis in range(3)] == \
+        pytest.approx([0.25, -0.25, 0.25])
+
+
+def test_tracked_position_needs_no_query(carrier, simulator):
+    lines = record_writes(simulator)
+    carrier.move_to(0.25, 0)
+    assert carrier.get_position(0) == 0.25
+    assert lines == [b'X0RNY-800\r']
+
+
+def test_refresh_reads_the_counter(carrier, simulator):
+    carrier.move_to(0.25, 1)
+    sleep(motion.duration(800, 100, 6000, 20000) + 0.05)
+    lines = record_writes(simulator)
+    assert carrier.get_position(1, refresh=True) == 0.25
+    assert lines == [b'Y0m\r']
+
+
+def test_reconcile_every(simulator):
+    carrier = make_carrier(simulator, reconcile_every=2)
+    lines = record_writes(simulator)
+    for position in (0.01, 0.02, 0.03):
+        carrier.move_to(position, 2)
+        sleep(0.3)
+    assert lines == [b'Z0RNY+32\r', b'Z0RNY+32\r', b'Z0m\r',
+                     b'Z0RNY+32\r']
+
+
+def test_stop_forgets_the_positions(carrier, simulator):
+    carrier.move_to(1.0, 0)
+    sleep(0.05)
+    carrier.stop()
+    lines = record_writes(simulator)
+    assert 0.0 < carrier.get_position(0) < 1.0
+    assert lines == [b'X0m\r']
+
+
+def test_move_to_xyz_sends_one_line(carrier, simulator):
+    lines = record_writes(simulator)
+    assert carrier.move_to_xyz(0.25, 0.5, 0.75)
+    assert lines == [b'X0RNY-800,Y0RNY-1600,Z0RNY+2400\r']
+    assert [carrier.get_position(axis) for axis in range(3)] == \
+        [0.25, 0.5, 0.75]
+
+
+def test_move_off_limits_moves_nothing(carrier, simulator):
+    lines = record_writes(simulator)
+    assert not carrier.move_to_xyz(1.0, 1.0, -1.0)
+    assert lines == []
+
+
+def test_move_by_xyz(carrier, simulator):
+    carrier.move_to_xyz(0.25, 0.25, 0.25)
+    sleep(motion.duration(800, 100, 6000, 20000) + 0.05)
+    lines = record_writes(simulator)
+    assert carrier.move_by_xyz(dx=0.25, dz=-0.25)
+    assert lines == [b'X0RNY-800,Z0RNY-800\r']
+
+
+def test_wait_returns_once_the_move_is_done(carrier):
+    predicted = carrier.move_time(1, 1600)
+    assert predicted == motion.duration(1600, 100, 6000, 20000)
+    began = monotonic()
+    assert carrier.move_to_xyz(0.25, 0.5, 0.0, wait=True)
+    assert predicted <= monotonic() - began < predicted + 0.2
+    assert [carrier.get_position(axis, refresh=True)
+            for axis in range(3)] == [0.25, 0.5, 0.0]
+
+
+def test_wait_gives_up_on_a_stuck_axis(carrier, simulator):
+    carrier.move_to(1.0, 0)
+    sleep(0.05)
+    # The axis stops on its own, e.g. at a limit switch
+    simulator.axes[b'X'].halt(monotonic())
+    assert not carrier.wait_until_idle(timeout=0.3)
+
+
+def test_settings_are_cached(carrier, simulator):
+    lines = record_writes(simulator)
+    assert carrier.get_end_velocity(0) == 6000
+    # Acknowledged values are not sent again
+    assert carrier._set_end_velocity(0, 6000)
+    assert lines == []
+    assert carrier._set_end_velocity(0, 5000)
+    assert carrier.get_end_velocity(0) == 5000
+    assert carrier.get_end_velocity(0, refresh=True) == 5000
+    assert lines == [b'X0E5000\r', b'X0e\r']
+
+
+def test_rejected_setting_is_forgotten(carrier, simulator):
+    assert not carrier._set_end_velocity(1, 50000)
+    assert carrier.parameters["end_velocity"][1] is None
+    assert carrier.get_end_velocity(1) == 6000
+
+
+def test_pipeline_keeps_the_order(carrier):
+    carrier.move_to_xyz(0.5, 0.25, 1.0, wait=True)
+    lines = [carrier._query_line(axis, opcode)
+             for _ in range(5) for opcode in 'mbe' for axis in range(3)]
+    replies = carrier.pipeline(lines, window=4)
+    assert [reply[:3] for reply in replies] == [line[:3] for line in lines]
+    assert [carrier._to_steps(reply, line)
+            for line, reply in zip(lines[:3], replies)] == \
+        [-1600, -800, 3200]
+
+
+def test_shutdown_returns_home_after_a_running_move(carrier, simulator):
+    carrier.move_to_xyz(0.5, 0.25, 0.5)
+    carrier.shutdown()
+    now = monotonic()
+    assert [axis.position(now) for axis in simulator.axes.values()] == \
+        [0, 0, 0]
+    assert not any(axis.busy(now) for axis in simulator.axes.values())
+
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+MotionProgram: sign conventions, encoding and limit checks.
+"""
+
+import pytest
+
+from motionprogram import MotionProgram
+from periphery import OutOfLimitException
+
+LIMITS = ((0, 10), (0, 10), (0, 10))
+
+
+def test_x_and_y_run_against_the_counters():
+    program = MotionProgram([[1.0, 2.0, 3.0]], LIMITS, 100)
+    assert program.targets.tolist() == [[-100, -200, 300]]
+
+
+def test_one_line_per_point():
+    program = MotionProgram([[1.0, 0.0, 0.0], [1.0, 0.5, 0.0],
+                             [1.0, 0.5, 0.0], [0.0, 0.0, 0.25]], LIMITS, 100)
+    assert [program.line(index) for index in range(len(program))] == \
+        [b'X0RNY-100\r', b'Y0RNY-50\r', b'',
+         b'X0RNY+100,Y0RNY+50,Z0RNY+25\r']
+    assert program.buffer == b''.join(
+        program.line(index) for index in range(len(program)))
+    assert program.moves(1) == {1: -50}
+
+
+def test_every_point_off_limits_is_reported():
+    with pytest.raises(OutOfLimitException) as error:
+        MotionProgram([[1.0, 1.0, 1.0], [-1.0, 1.0, 1.0], [1.0, 1.0, 1.0],
+                       [1.0, 11.0, -1.0]], LIMITS, 100)
+    assert error.value.expression['indices'] == [1, 3]
+    assert error.value.expression['axes'] == ['X', 'YZ']
+
+
+def test_carrier_executes_the_program(carrier):
+    points = [[0.25, 0.0, 0.0], [0.25, 0.25, 0.5]]
+    program = MotionProgram.for_carrier(carrier, points)
+    for index in range(len(program)):
+        assert carrier.execute(program, index, wait=True)
+    assert carrier.get_positions(refresh=True) == pytest.approx(points[-1])
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+ScanRecorder: memory-mapped records and resuming a scan from them.
+"""
+
+import pytest
+
+from recorder import ScanRecorder
+from scan import Scan
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'map.npy')
+
+
+def test_only_complete_records_are_loaded(path):
+    with ScanRecorder(path, 4, channels=2) as recorder:
+        recorder.record(0, [0, 0, 0], [1.0, 2.0])
+        recorder.record(2, [-160, None, 0], [3.0, 4.0])
+    records = ScanRecorder.load(path)
+    assert records['index'].tolist() == [0, 2]
+    assert records['steps'][1].tolist() == [-160, -1, 0]
+    assert records['values'].tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+
+def test_other_layout_is_refused(path):
+    ScanRecorder(path, 4).close()
+    with pytest.raises(ValueError):
+        ScanRecorder(path, 5)
+
+
+def test_resume_skips_completed_points(carrier, path):
+    points = [[index * 0.05, 0.0, 0.0] for index in range(5)]
+    measured = []
+
+    def measure(index, point):
+        measured.append(index)
+        if index == 2:
+            raise RuntimeError('instrument lost')
+        return float(index)
+    with ScanRecorder(path, len(points)) as recorder:
+        with pytest.raises(RuntimeError):
+            Scan(carrier, points).run(measure, recorder=recorder)
+    # Second session: the file says points 0 and 1 are done
+    measured.clear()
+    with ScanRecorder(path, len(points)) as recorder:
+        assert recorder.completed() == 2
+        Scan(carrier, points).run(lambda index, point: float(index),
+                                  recorder=recorder)
+        Scan(carrier, points).run(measure, recorder=recorder)
+    assert measured == []
+    records = ScanRecorder.load(path)
+    assert records['index'].tolist() == list(range(5))
+    assert records['values'][:, 0].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert records['steps'][4].tolist() == [-640, 0, 0]
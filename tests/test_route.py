@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Point order optimizer: the route visits every point once and is never
+slower than the input order.
+"""
+
+import numpy as np
+import pytest
+
+from route import TravelModel, optimize_route
+
+MODEL = TravelModel([100] * 3, [6000] * 3, 20000, 3200)
+
+
+def test_route_is_a_permutation():
+    points = np.random.default_rng(1).uniform(0, 10, (200, 3))
+    route = optimize_route(points, MODEL, start=[0, 0, 0])
+    assert sorted(route.order.tolist()) == list(range(len(points)))
+    assert np.array_equal(route.points, points[route.order])
+    assert route.time == pytest.approx(
+        MODEL.path_time(route.points, [0, 0, 0]))
+
+
+def test_route_is_not_slower():
+    rng = np.random.default_rng(2)
+    for count in (3, 10, 100):
+        points = rng.uniform(0, 10, (count, 3))
+        route = optimize_route(points, MODEL)
+        assert route.order[0] == 0
+        assert route.time <= route.naive_time
+
+
+def test_shuffled_line_is_put_back_in_order():
+    points = np.zeros((20, 3))
+    points[:, 0] = np.random.default_rng(3).permutation(20) * 0.5
+    route = optimize_route(points, MODEL, start=[0, 0, 0])
+    assert np.array_equal(route.points[:, 0], np.arange(20) * 0.5)
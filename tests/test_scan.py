@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Serpentine scans on the simulator.
+"""
+
+import numpy as np
+import pytest
+
+from periphery import OutOfLimitException
+from scan import Scan, axis_values, serpentine
+
+
+def test_axis_values_include_both_ends():
+    assert axis_values((0, 1), 0.25).tolist() == [0, 0.25, 0.5, 0.75, 1]
+    assert axis_values((1, 0), 0.5).tolist() == [1, 0.5, 0]
+
+
+def test_serpentine_order():
+    points = serpentine([0, 1, 2], [0, 1], [0, 1])
+    assert points.tolist() == [
+        [0, 0, 0], [1, 0, 0], [2, 0, 0],
+        [2, 1, 0], [1, 1, 0], [0, 1, 0],
+        [0, 1, 1], [1, 1, 1], [2, 1, 1],
+        [2, 0, 1], [1, 0, 1], [0, 0, 1]]
+    # The gantry never jumps: one pitch along one axis per point
+    assert (np.abs(np.diff(points, axis=0)).sum(axis=1) == 1).all()
+
+
+def test_points_off_limits_are_reported(carrier):
+    scan = Scan(carrier, [[0, 0, 0], [90, 0, 0], [1, 0, 0], [1, 0, -1]])
+    with pytest.raises(OutOfLimitException) as error:
+        scan.compile()
+    assert error.value.expression['indices'] == [1, 3]
+
+
+def test_run_measures_at_every_point(carrier):
+    scan = Scan.grid(carrier, x=(0, 0.1), y=(0, 0.05), pitch=0.05)
+    positions = scan.run(lambda index, point: [
+        carrier.get_position(axis, refresh=True) for axis in range(3)])
+    assert np.allclose(positions, scan.points)
+    assert scan.progress.done == len(scan.points) == 6
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+GantryServer and GantryClient over localhost TCP.
+"""
+
+import threading
+from time import sleep
+
+import pytest
+
+from conftest import drop_replies
+from periphery import PeripheryException, ResponseTimeoutException
+from server import GantryClient, GantryServer
+
+
+@pytest.fixture
+def server(carrier):
+    server = GantryServer(carrier, ('127.0.0.1', 0), status_interval=0.02)
+    server.start()
+    yield server
+    server.close(shutdown=False)
+
+
+@pytest.fixture
+def client(server):
+    client = GantryClient(server.address)
+    yield client
+    client.close()
+
+
+def test_round_trip(client):
+    assert client.carrier.move_to(0.25, 0, wait=True) is True
+    assert client.carrier.get_positions(refresh=True) == \
+        pytest.approx([0.25, 0.0, 0.0])
+    assert client.carrier.limits() == [[0.0, 80.0], [-30.0, 30.0],
+                                       [0.0, 80.0]]
+
+
+def test_errors_reach_the_client(client, carrier, simulator):
+    with pytest.raises(PeripheryException, match='Unknown method'):
+        client.call('close').result(1.0)
+    # Would close the port under every other client
+    with pytest.raises(PeripheryException, match='Unknown method'):
+        client.call('shutdown').result(1.0)
+    carrier.constants["read_timeout"] = 0.05
+    drop_replies(simulator, b'X0m')
+    with pytest.raises(ResponseTimeoutException):
+        client.carrier.get_position(0, refresh=True)
+
+
+def test_status_is_pushed_to_every_client(server, client):
+    other = GantryClient(server.address)
+    received = threading.Event()
+
+    def listener(status):
+        if status['position'][1] == pytest.approx(0.1):
+            received.set()
+    other.add_listener(listener)
+    client.carrier.move_to(0.1, 1, wait=True)
+    assert received.wait(1.0)
+    other.close()
+
+
+def test_stop_preempts_a_remote_move(client):
+    moving = client.call('move_to', 10.0, 0, wait=True)
+    queued = client.call('move_to', 1.0, 1, wait=True)
+    sleep(0.1)
+    latency = client.halt()
+    assert latency < 0.05
+    assert moving.result(1.0) is False
+    with pytest.raises(PeripheryException, match='Cancelled'):
+        queued.result(1.0)
+    # The positions are read back from the controller after a stop
+    assert 0.0 <= client.carrier.get_position(0) < 10.0
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+The simulator answers like a SimpleStep controller.
+"""
+
+from time import monotonic, sleep
+
+import motion
+from simulator import SimpleStepSimulator
+
+
+def exchange(simulator, line: bytes, replies: int = 1) -> bytes:
+    simulator.write(line)
+    received = b''
+    while received.count(b'\r') < replies:
+        received += simulator.read(1)
+    return received
+
+
+def test_every_command_is_answered_with_its_echo(simulator):
+    assert exchange(simulator, b'X0m,Y0e,Z0b\r', 3) == \
+        b'X0m0\rY0e6000\rZ0b100\r'
+
+
+def test_rejected_command(simulator):
+    assert exchange(simulator, b'X0E0\r') == b'X0?\r'
+    assert exchange(simulator, b'Q0m\r') == b'Q0?\r'
+
+
+def test_move_follows_the_trapezoidal_profile(simulator):
+    steps = 2000
+    predicted = motion.duration(steps, 100, 6000, 20000)
+    began = monotonic()
+    assert exchange(simulator, b'X0RNY+2000\r') == b'X0R\r'
+    # A move is rejected while the axis is still busy
+    assert exchange(simulator, b'X0RNY+10\r') == b'X0?\r'
+    sleep(max(0.0, began + predicted / 2 - monotonic()))
+    assert 0 < int(exchange(simulator, b'X0m\r')[3:-1]) < steps
+    sleep(max(0.0, began + predicted + 0.01 - monotonic()))
+    assert exchange(simulator, b'X0m\r') == b'X0m2000\r'
+
+
+def test_replies_take_the_transfer_time():
+    simulator = SimpleStepSimulator(latency=0.0, baudrate=1200)
+    began = monotonic()
+    exchange(simulator, b'X0m\r')
+    # 4 bytes out and 5 back at 10 bits per byte
+    assert monotonic() - began >= 9 * 10 / 1200 * 0.9
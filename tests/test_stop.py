@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Carrier.stop from another thread: waits end early, queued calls,
+scans and tuning are cancelled.
+"""
+
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+import tuning
+from conftest import record_writes
+from linact import STOP_ALL
+from periphery import StoppedException
+from scan import Scan
+from worker import CarrierWorker
+
+
+def run_in_thread(function, *args, **kwargs):
+    """Start function on a thread, return the thread and its outcome"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = function(*args, **kwargs)
+        except Exception as exception:
+            outcome['error'] = exception
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def test_stop_preempts_a_waiting_move(carrier):
+    began = monotonic()
+    mover, moved = run_in_thread(carrier.move_to, 10.0, 0, wait=True)
+    sleep(0.1)
+    # Blocks on the carrier until the move is over or stopped
+    querier, queried = run_in_thread(carrier.get_positions, refresh=True)
+    sleep(0.05)
+    latency = carrier.stop()
+    mover.join(1.0)
+    querier.join(1.0)
+    assert monotonic() - began < 1.0
+    assert latency < 0.05
+    assert moved == {'result': False}
+    assert isinstance(queried.get('error'), StoppedException)
+    # The axis stopped short, its counter is read back
+    assert 0.0 < carrier.get_position(0) < 10.0
+
+
+def test_halt_cancels_the_queue(carrier):
+    worker = CarrierWorker(carrier, status_interval=0)
+    worker.start()
+    moving = worker.submit(carrier.move_to, 10.0, 0, wait=True)
+    queued = [worker.submit(carrier.move_to, 1.0, 1, wait=True)
+              for _ in range(3)]
+    sleep(0.1)
+    worker.halt()
+    assert moving.result(1.0) is False
+    assert all(future.cancelled() for future in queued)
+    worker.stop()
+    worker.join(1.0)
+
+
+def test_stop_between_two_scan_points(carrier):
+    scan = Scan(carrier, [[index * 0.05, 0.0, 0.0] for index in range(5)])
+
+    def measure(index, point):
+        if index == 1:
+            carrier.stop()
+        return index
+    with pytest.raises(StoppedException):
+        scan.run(measure)
+    assert scan.visited.tolist() == [True, True, False, False, False]
+
+
+def test_stop_during_tuning(carrier, simulator, tmp_path):
+    path = tmp_path / 'profile.json'
+    lines = record_writes(simulator)
+    threading.Timer(0.3, carrier.stop).start()
+    with pytest.raises(StoppedException):
+        tuning.tune(carrier, axes=(0,), path=str(path), distance=0.5,
+                    repeats=1)
+    # Neither moved back nor saved
+    stop = lines.index(STOP_ALL)
+    assert not [line for line in lines[stop:] if b'RN' in line]
+    assert not path.exists()
+
+
+def test_stop_during_a_scan_move(carrier):
+    scan = Scan(carrier, [[0.0, 0.0, 0.0], [10.0, 0.0, 0.0],
+                          [20.0, 0.0, 0.0]])
+    scanner, scanned = run_in_thread(scan.run)
+    sleep(0.2)
+    carrier.stop()
+    scanner.join(1.0)
+    assert isinstance(scanned.get('error'), StoppedException)
+    assert scan.visited.tolist() == [True, False, False]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Velocity tuning against a simulated axis that stalls above a velocity.
+"""
+
+import pytest
+
+import tuning
+from conftest import make_carrier
+from linact import VELOCITY_PROFILE, load_velocity_profile, \
+    save_velocity_profile
+from simulator import SimpleStepSimulator
+
+STALL = 2000
+
+
+@pytest.fixture
+def stalling():
+    return make_carrier(SimpleStepSimulator(stall_velocity=STALL),
+                        velocity=1000)
+
+
+def test_tuned_velocities_stay_below_the_stall(stalling, tmp_path):
+    path = str(tmp_path / 'profile.json')
+    profile = tuning.tune(stalling, axes=(0,), path=path, distance=0.1,
+                          repeats=1)
+    entry = profile['X']
+    assert 1000 <= entry["end_velocity"] < STALL
+    assert 100 < entry["begin_velocity"] <= entry["end_velocity"]
+    assert load_velocity_profile(path) == {
+        'X': {"begin_velocity": entry["begin_velocity"],
+              "end_velocity": entry["end_velocity"]}}
+    # The axis is back where tuning started
+    assert stalling.get_position(0, refresh=True) == 0.0
+
+
+def test_initialize_loads_the_profile(stalling, tmp_path):
+    path = str(tmp_path / 'profile.json')
+    tuning.tune(stalling, axes=(0,), path=path, distance=0.1, repeats=1)
+    carrier = make_carrier(SimpleStepSimulator(stall_velocity=STALL),
+                           velocity=1000, profile=path)
+    entry = load_velocity_profile(path)['X']
+    assert carrier.get_end_velocities(refresh=True) == \
+        [entry["end_velocity"], 1000, 1000]
+    assert carrier.get_begin_velocity(0, refresh=True) == \
+        entry["begin_velocity"]
+
+
+def test_failing_begin_velocity_leaves_the_axis_untuned(stalling,
+                                                         monkeypatch):
+    real = tuning.test_move
+
+    def failing(carrier, axis, *args):
+        # The end velocity tuned below the stall fails with any begin
+        if carrier.parameters["end_velocity"][axis] == int(0.9 * STALL):
+            return None
+        return real(carrier, axis, *args)
+    monkeypatch.setattr(tuning, 'test_move', failing)
+    assert tuning.tune_axis(stalling, 0, distance=0.1, repeats=1) is None
+    assert stalling.get_position(0, refresh=True) == 0.0
+
+
+def test_profile_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_velocity_profile(VELOCITY_PROFILE, {
+        'X': {"begin_velocity": 400, "end_velocity": 9000}})
+    assert make_carrier().get_end_velocities(refresh=True) == [6000] * 3
+    carrier = make_carrier(profile=VELOCITY_PROFILE)
+    assert carrier.get_end_velocities(refresh=True) == [9000, 6000, 6000]
+
+
+def test_tune_saves_to_the_default_file(stalling, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    profile = tuning.tune(stalling, axes=(0,), distance=0.1, repeats=1)
+    assert load_velocity_profile(VELOCITY_PROFILE)['X'] == {
+        "begin_velocity": profile['X']["begin_velocity"],
+        "end_velocity": profile['X']["end_velocity"]}
+
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+CarrierWorker runs the carrier's commands on its own thread.
+"""
+
+from time import monotonic, sleep
+
+import pytest
+
+from scan import Scan
+from worker import CarrierWorker
+
+
+@pytest.fixture
+def worker(carrier):
+    worker = CarrierWorker(carrier, status_interval=0.02)
+    worker.start()
+    yield worker
+    worker.stop()
+    worker.join(2.0)
+
+
+def test_commands_run_in_order(worker, carrier):
+    worker.submit(carrier.move_to, 0.25, 0, wait=True)
+    position = worker.submit(carrier.get_position, 0, refresh=True)
+    assert position.result(2.0) == 0.25
+
+
+def test_status_is_polled(worker):
+    deadline = monotonic() + 1.0
+    while worker.status()['time'] is None and monotonic() < deadline:
+        sleep(0.01)
+    status = worker.status()
+    assert status['position'] == [0.0, 0.0, 0.0]
+    assert status['busy'] is False
+
+
+def test_errors_go_to_the_future_and_the_status(worker):
+    def fail():
+        raise ValueError('broken')
+    with pytest.raises(ValueError):
+        worker.submit(fail).result(2.0)
+    assert worker.status()['error'] == 'broken'
+
+
+def test_scan_points_are_published_while_the_scan_runs(worker, carrier):
+    scan = Scan(carrier, [[index * 0.05, 0.0, 0.0] for index in range(4)])
+    published = []
+    worker.add_listener(lambda status: published.append(status['position']))
+    worker.submit(scan.run, progress=worker.publish_position).result(5.0)
+    reached = [position[0] for position in published]
+    for point in scan.points:
+        assert point[0] == pytest.approx(min(
+            reached, key=lambda value: abs(value - point[0])))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Velocity auto-tuning of a Carrier.
+
+tune() looks for the fastest begin/end velocities every axis still runs
+reliably at: it raises the end velocity, then the begin velocity, step
+by step and times out-and-back test moves at each setting. A setting
+fails when a move does not reach its target in time or the step counter
+read back with the m query afterwards is off. The fastest passing values,
+reduced by a safety margin, are written to a velocity profile file,
+which Carrier.initialize loads from then on if the carrier is created
+with it.
+
+    carrier = Carrier(profile=VELOCITY_PROFILE)
+    carrier.initialize()
+    profile = tuning.tune(carrier, axes=(0, 1))
+"""
+
+import logging
+import os
+from time import monotonic
+
+from linact import (AXES, VELOCITY_PROFILE, Carrier, load_velocity_profile,
+                    save_velocity_profile)
+from periphery import OutOfLimitException, StoppedException
+
+logger = logging.getLogger('MainLogger.Tuning')
+
+
+def test_move(carrier: Carrier, axis: int, distance: float = 2.0,
+              repeats: int = 2) -> float:
+    """Move an axis out by distance cm and back, repeats times, at its
+    current settings. The distance is raised so that the moves reach the
+    end velocity. Returns the mean seconds per round trip, None if a move
+    missed its target, steps were lost or the carrier was stopped"""
+    stops = carrier._stops
+    begin = carrier.parameters["begin_velocity"][axis] or \
+        carrier.constants["Start_velocity"]
+    end = carrier.parameters["end_velocity"][axis] or \
+        carrier.parameters["velocity"]
+    # Steps ramping up and down again, with some cruise in between
+    ramps = max(end ** 2 - begin ** 2, 0) / carrier.constants["acceleration"]
+    distance = max(distance, 1.25 * ramps * carrier.constants["cm_per_step"])
+    start = carrier.get_position(axis)
+    lower, upper = carrier.limits()[axis]
+    target = start + distance if start + distance <= upper \
+        else start - distance
+    if target < lower:
+        raise OutOfLimitException(
+            {'axis': AXES[axis], 'distance': distance,
+             'limits': (lower, upper)},
+            'No room for the test move')
+    # Counter the last move back to start is commanded to end at
+    home = carrier._steps[axis]
+    began = monotonic()
+    for _ in range(repeats):
+        for position in (target, start):
+            if carrier._stops != stops or \
+                    not carrier.move_to(position, axis, wait=True):
+                return None
+    elapsed = (monotonic() - began) / repeats
+    # Counter read back after the moves against the commanded one
+    if carrier._query_steps(axis) != home:
+        return None
+    return elapsed
+
+
+def _check_stop(carrier: Carrier, stops: int, axis: int):
+    # The carrier counts its stops; one since tuning began ends it before
+    # anything else moves or gets saved
+    if carrier._stops != stops:
+        raise StoppedException(
+            'Tuning of the {0} axis stopped'.format(AXES[axis]))
+
+
+def _apply(carrier: Carrier, axis: int, begin: int, end: int):
+    for parameter, opcode, value in (("begin_velocity", "B", begin),
+                                     ("end_velocity", "E", end)):
+        values = [None] * len(AXES)
+        values[axis] = value
+        carrier._set_axis_parameter(parameter, opcode, values)
+
+
+def _recover(carrier: Carrier, axis: int, start: float, begin: int,
+             end: int):
+    """Return to the start of the test moves at settings known to work"""
+    _apply(carrier, axis, begin, end)
+    carrier.sync_position(axis)
+    if not carrier.move_to(start, axis, wait=True):
+        raise OutOfLimitException(
+            {'axis': AXES[axis], 'position': start},
+            'Axis did not return to the start of the test moves')
+
+
+def _fastest(carrier: Carrier, axis: int, candidates, settings, index: int,
+             distance: float, repeats: int, stops: int):
+    """Try candidates for settings[index] (0: begin, 1: end) in
+    ascending order. Returns the last passing value and its timing.
+    Raises StoppedException if the carrier was stopped"""
+    start = carrier.get_position(axis)
+    best = None
+    for value in candidates:
+        trial = list(settings)
+        trial[index] = value
+        _apply(carrier, axis, *trial)
+        seconds = test_move(carrier, axis, distance, repeats)
+        _check_stop(carrier, stops, axis)
+        logger.info("%s axis begin %d end %d: %s", AXES[axis], trial[0],
+                    trial[1], 'failed' if seconds is None
+                    else '{0:.3f} s'.format(seconds))
+        if seconds is None:
+            _recover(carrier, axis, start, *(settings if best is None
+                                              else best[1]))
+            break
+        best = (value, trial, seconds)
+    return best
+
+
+def tune_axis(carrier: Carrier, axis: int, distance: float = 2.0,
+              repeats: int = 2, end_step: int = 500,
+              margin: float = 0.9) -> dict:
+    """Fastest reliable begin and end velocity of one axis, starting from
+    its current settings. The end velocity is raised by end_step at a
+    time, the begin velocity is doubled. Returns the profile entry of the
+    axis, None if even the current settings fail. A carrier stop()
+    ends tuning with StoppedException, leaving the axis where it is"""
+    stops = carrier._stops
+    begin = carrier.get_begin_velocity(axis) or \
+        carrier.constants["Start_velocity"]
+    end = carrier.get_end_velocity(axis) or carrier.parameters["velocity"]
+    maximum = carrier.constants["Max_velocity"]
+    fastest = _fastest(carrier, axis,
+                       range(end, maximum + 1, end_step), (begin, end), 1,
+                       distance, repeats, stops)
+    if fastest is None:
+        logger.warning("%s axis fails at its current settings", AXES[axis])
+        return None
+    end = max(end, int(fastest[0] * margin))
+    doubled = [begin]
+    while doubled[-1] * 2 <= end:
+        doubled.append(doubled[-1] * 2)
+    fastest = _fastest(carrier, axis, doubled, (begin, end), 0, distance,
+                       repeats, stops)
+    if fastest is None:
+        logger.warning("%s axis fails at begin velocity %d with end "
+                       "velocity %d", AXES[axis], begin, end)
+        return None
+    begin = max(begin, int(fastest[0] * margin))
+    _apply(carrier, axis, begin, end)
+    seconds = test_move(carrier, axis, distance, repeats)
+    _check_stop(carrier, stops, axis)
+    if seconds is None:
+        raise OutOfLimitException(
+            {'axis': AXES[axis], 'begin_velocity': begin,
+             'end_velocity': end},
+            'Tuned settings failed their check')
+    return {"begin_velocity": begin, "end_velocity": end,
+            "test_move_time": round(seconds, 4)}
+
+
+def tune(carrier: Carrier, axes=None, path: str = None, **kwargs) -> dict:
+    """Tune the given axes (default: all) of an initialized carrier, one
+    after the other, and save the results to path (default: the
+    carrier's profile file, else VELOCITY_PROFILE). Entries of other axes are kept. kwargs are
+    passed on to tune_axis. Returns the saved profile. After a carrier
+    stop() nothing is saved and StoppedException is raised"""
+    stops = carrier._stops
+    path = path or carrier.parameters["profile"] or VELOCITY_PROFILE
+    profile = load_velocity_profile(path) \
+        if os.path.exists(path) else {}
+    for axis in range(len(AXES)) if axes is None else axes:
+        entry = tune_axis(carrier, axis, **kwargs)
+        _check_stop(carrier, stops, axis)
+        if entry is not None:
+            profile[AXES[axis]] = entry
+            logger.info("%s axis tuned: %s", AXES[axis], entry)
+    save_velocity_profile(path, profile)
+    logger.info("Velocity profile saved to %s", path)
+    return profile
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Background thread that owns all serial I/O of a Carrier.
+
+Callers enqueue Carrier calls with submit() and get a Future back, so a
+GUI never blocks on the serial line. Between commands the worker polls
+the positions at a fixed rate and publishes them as a status snapshot.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+from linact import AXES
+from periphery import StoppedException
+
+
+class CarrierWorker(threading.Thread):
+    """Runs Carrier commands from a queue and keeps a status snapshot"""
+
+    def __init__(self, carrier, status_interval: float = 0.5):
+        threading.Thread.__init__(self, name='CarrierWorker', daemon=True)
+        self.carrier = carrier
+        # Seconds between two position polls, 0 disables polling
+        self.status_interval = status_interval
+        self.logger = logging.getLogger('MainLogger.CarrierWorker')
+        self._commands = queue.Queue()
+        self._status_lock = threading.Lock()
+        self._status = {'position': [None] * len(AXES),
+                        'end_velocity': [None] * len(AXES),
+                        'busy': False, 'error': None, 'time': None}
+        self._running = True
+        # Called with every new status snapshot, on the worker thread
+        self._listeners = []
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """Queue function(*args, **kwargs) to run on the worker thread"""
+        future = Future()
+        self._commands.put((future, function, args, kwargs))
+        return future
+
+    def status(self) -> dict:
+        """Copy of the latest status snapshot"""
+        with self._status_lock:
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in self._status.items()}
+
+    def add_listener(self, listener):
+        """Call listener(status) with a copy of every status update. It
+        runs on the worker thread and must return quickly"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def halt(self) -> float:
+        """Stop the carrier right away from the calling thread and cancel
+        all queued commands. The running command ends early. Returns the
+        stop latency, see Carrier.stop"""
+        cancelled = 0
+        finish = False
+        while True:
+            try:
+                item = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                finish = True
+            elif item[0].cancel():
+                cancelled += 1
+        if finish:
+            self._commands.put(None)
+        latency = self.carrier.stop()
+        self.logger.info("Halted, %d queued commands cancelled", cancelled)
+        return latency
+
+    def stop(self):
+        """Let the thread finish after the commands queued so far"""
+        self._commands.put(None)
+
+    def run(self):
+        next_poll = monotonic()
+        while self._running:
+            timeout = None
+            if self.status_interval:
+                timeout = max(0.0, next_poll - monotonic())
+            try:
+                item = self._commands.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if item is None:
+                self._running = False
+            elif item:
+                self._execute(*item)
+            if self.status_interval and monotonic() >= next_poll:
+                self._poll()
+                next_poll = monotonic() + self.status_interval
+
+    def _execute(self, future: Future, function, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        self._update(busy=True)
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as exception:
+            self.logger.exception("Command failed")
+            self._update(error=str(exception))
+            future.set_exception(exception)
+        finally:
+            self._update(busy=not self._commands.empty())
+
+    def _poll(self):
+        """Read the live positions into the status snapshot"""
+        carrier = self.carrier
+        if not carrier.serial_connection.is_open:
+            return
+        try:
+            positions = carrier.get_positions(refresh=True)
+        except StoppedException:
+            return
+        except Exception as exception:
+            self.logger.warning("Status poll failed: %s", exception)
+            self._update(error=str(exception))
+            return
+        self._update(position=positions,
+                     end_velocity=list(carrier.parameters["end_velocity"]),
+                     time=monotonic())
+
+    def publish_position(self, *args):
+        """Publish the tracked positions without asking the controller.
+        For long commands, which block the poll, to call between moves
+        (e.g. as a Scan progress callback); arguments are ignored"""
+        carrier = self.carrier
+        self._update(position=carrier.get_positions(),
+                     end_velocity=list(carrier.parameters["end_velocity"]),
+                     time=monotonic())
+
+    def _update(self, **values):
+        with self._status_lock:
+            self._status.update(values)
+        if self._listeners:
+            status = self.status()
+            for listener in list(self._listeners):
+                listener(status)